@@ -0,0 +1,65 @@
+"""
+Microbenchmark for question text extraction
+Per-block latency of the compiled pattern set vs the sequential regex loop
+"""
+import re
+import sys
+import time
+import fitz  # PyMuPDF
+from question import QuestionExtractor
+
+LEGACY_PATTERNS = [
+    r'Question Label\s*:\s*[^\n]*\n\n([^\n]+\?)',
+    r'Based on.*?answer.*?\n\n([^\n]+\?)',
+    r'([A-Z][^\n]*\?)',
+    r'What is.*?\?',
+    r'How (?:much|many).*?\?',
+    r'Which of.*?\?',
+    r'In how many.*?\?',
+    r'If .*?\?',
+]
+
+def legacy_match_question_text(block):
+    """Sequential findall over every pattern, as extract_question_text used to do"""
+    for pattern in LEGACY_PATTERNS:
+        matches = re.findall(pattern, block, re.IGNORECASE | re.DOTALL)
+        if matches:
+            question = max(matches, key=len).strip()
+            if len(question) > 15 and '?' in question:
+                return question
+    return None
+
+def time_per_block(match, blocks, rounds):
+    """Latency of each call in microseconds"""
+    timings = []
+    for _ in range(rounds):
+        for block in blocks:
+            start = time.perf_counter()
+            match(block)
+            timings.append((time.perf_counter() - start) * 1e6)
+    return sorted(timings)
+
+def report(name, timings):
+    mean = sum(timings) / len(timings)
+    p95 = timings[int(len(timings) * 0.95)]
+    print(f"{name:<12} mean {mean:9.1f} us   p95 {p95:9.1f} us   max {timings[-1]:9.1f} us")
+
+def main():
+    pdf_path = sys.argv[1] if len(sys.argv) > 1 else "test.pdf"
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    extractor = QuestionExtractor()
+    with fitz.open(pdf_path) as doc:
+        blocks = list(extractor.stream_question_blocks(doc))
+
+    # Long blocks without a question mark are the worst case for lazy patterns
+    hard_blocks = [block.replace("?", ".") * 4 for block in blocks]
+
+    print(f"📊 {len(blocks)} blocks from {pdf_path}, {rounds} rounds")
+    for label, sample in [("Question blocks", blocks), ("Blocks without '?'", hard_blocks)]:
+        print(f"\n{label}:")
+        report("sequential", time_per_block(legacy_match_question_text, sample, rounds))
+        report("compiled", time_per_block(extractor.match_question_text, sample, rounds))
+
+if __name__ == "__main__":
+    main()
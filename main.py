@@ -26,7 +26,9 @@ def main():
     print("\n🔍 STEP 1: EXTRACTING QUESTIONS")
     print("-" * 40)
     
-    extractor = QuestionExtractor()
+    # llava downsamples to its own patch grid, so don't render beyond it.
+    # Images are kept in memory so the solver doesn't read them back from disk.
+    extractor = QuestionExtractor(max_image_side=1344, keep_image_bytes=True)
     results = extractor.process_pdf(pdf_path)
     
     if not results["success"]:
@@ -35,6 +37,9 @@ def main():
     
     print(f"✅ Extracted {results['questions_extracted']} questions")
     
+    # Free the extraction model's memory before the solver loads llava
+    extractor.release_model()
+    
     # STEP 2: Solve with Ollama + Convert to PDF
     print(f"\n🧠 STEP 2: SOLVING WITH OLLAMA + PDF GENERATION")
     print("-" * 40)
@@ -42,14 +47,24 @@ def main():
     solver = OllamaDeepSeekSolver(
         images_dir='temp',
         latex_dir='latex_output',
-        model_name='llava:7b'
+        model_name='llava:7b',
+        concurrency=4  # OLLAMA_NUM_PARALLEL on our servers
     )
     
-    workflow_results = solver.run_complete_workflow()
+    workflow_results = solver.run_complete_workflow(results["questions"])
     
     if workflow_results:
         print("🎉 SUCCESS!")
         print(f"📊 Questions processed: {workflow_results['total_questions']}")
+        print(f"♻️ Cached solutions reused: {workflow_results['solution_cache_hits']}")
+        if workflow_results['latency_p50'] is not None:
+            print(f"⏱️ Latency p50 {workflow_results['latency_p50']:.1f}s, "
+                  f"p95 {workflow_results['latency_p95']:.1f}s at concurrency {workflow_results['concurrency_limit']}")
+        print(f"🔥 Model load {workflow_results['model_load_seconds']:.1f}s, "
+              f"inference {workflow_results['inference_seconds']:.1f}s")
+        if workflow_results['dead_letters']:
+            print(f"📮 {workflow_results['dead_letters']} questions failed; "
+                  f"replay them with run_complete_workflow(replay_dead_letters=True)")
         print(f"📄 Final PDF: {workflow_results['pdf_path']}")
         print(f"📁 LaTeX files: {workflow_results['latex_dir']}/")
         print("=" * 70)
@@ -0,0 +1,451 @@
+"""
+Ollama HTTP Client
+Connection-pooled sessions shared by every Ollama caller in the process,
+load balancing across several Ollama hosts, and model residency
+"""
+import time
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ReadTimeoutError
+
+DEFAULT_HOST = "http://localhost:11434"
+
+# Replies from a server that is shedding load rather than failing
+OVERLOAD_STATUS_CODES = (429, 503)
+
+class CircuitOpenError(Exception):
+    """Raised instead of sending a request while every host's circuit is open"""
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers, or None if it is empty"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def is_timeout(error):
+    """Whether a requests error is a timeout, including read timeouts while streaming
+    
+    requests raises those from iter_content/iter_lines as a ConnectionError
+    wrapping urllib3's ReadTimeoutError rather than as a Timeout.
+    """
+    if isinstance(error, requests.Timeout):
+        return True
+    return isinstance(error, requests.ConnectionError) and any(
+        isinstance(arg, ReadTimeoutError) for arg in error.args
+    )
+
+def host_of(url):
+    """scheme://host:port part of an Ollama URL"""
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+class OllamaClient:
+    def __init__(self, host=DEFAULT_HOST, pool_size=8, connect_timeout=5):
+        """Keep-alive session to one Ollama host with up to pool_size open connections"""
+        self.host = host.rstrip("/")
+        self.pool_size = 0
+        self.connect_timeout = connect_timeout
+        self.session = requests.Session()
+        self.lock = threading.Lock()
+        self.ensure_pool_size(pool_size)
+    
+    def ensure_pool_size(self, pool_size):
+        """Grow the connection pool to at least pool_size connections"""
+        with self.lock:
+            if pool_size <= self.pool_size:
+                return
+            
+            # Callers beyond the pool size wait for a connection instead of
+            # opening throwaway ones
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+            self.session.mount("http://", adapter)
+            self.session.mount("https://", adapter)
+            self.pool_size = pool_size
+    
+    def timeout(self, read_timeout):
+        """(connect, read) timeout pair for a request"""
+        return (self.connect_timeout, read_timeout)
+    
+    def get(self, path, read_timeout=5):
+        """GET a path on the host"""
+        return self.session.get(self.host + path, timeout=self.timeout(read_timeout))
+    
+    def post(self, path, payload, read_timeout=30, stream=False):
+        """POST a JSON payload to a path on the host"""
+        return self.session.post(
+            self.host + path, json=payload, timeout=self.timeout(read_timeout), stream=stream
+        )
+    
+    def close(self):
+        """Close all pooled connections"""
+        self.session.close()
+
+clients = {}
+clients_lock = threading.Lock()
+
+def get_client(host=DEFAULT_HOST, pool_size=8, connect_timeout=5):
+    """Shared client for a host, so all callers reuse the same connections
+    
+    The pool grows to the largest pool_size asked for; connect_timeout is
+    set by the first caller for a host.
+    """
+    host = host.rstrip("/")
+    with clients_lock:
+        client = clients.get(host)
+        if client is None:
+            client = clients[host] = OllamaClient(host, pool_size, connect_timeout)
+    
+    client.ensure_pool_size(pool_size)
+    return client
+
+def check_host(client, required_models=(), read_timeout=5):
+    """Whether a host answers and has every required model, with a status message"""
+    try:
+        response = client.get("/api/tags", read_timeout=read_timeout)
+        if response.status_code != 200:
+            return False, f"{client.host} not responding"
+        
+        model_names = [model['name'] for model in response.json().get('models', [])]
+        missing = [model for model in required_models if model not in model_names]
+        if missing:
+            return False, f"{client.host} lacks {', '.join(missing)}. Available: {model_names}"
+        
+        return True, f"{client.host} ready"
+    except Exception as e:
+        return False, f"{client.host} connection failed: {e}"
+
+class OllamaPool:
+    def __init__(self, hosts, pool_size=8, connect_timeout=5, eject_seconds=30, failure_threshold=3,
+                 max_wait=0.0):
+        """Spread requests over Ollama hosts, least outstanding requests first
+        
+        Each host has a circuit breaker: failure_threshold failures in a row
+        (unreachable, timed out or a 5xx reply) open it, ejecting the host for
+        eject_seconds. It is then health-checked in the background and re-added
+        once that passes. While every circuit is open, requests wait up to
+        max_wait seconds for a host to be re-added, then fail with
+        CircuitOpenError instead of reaching a dead server.
+        """
+        self.clients = [get_client(host, pool_size, connect_timeout) for host in hosts]
+        self.eject_seconds = eject_seconds
+        self.failure_threshold = failure_threshold
+        self.required_models = ()
+        self.condition = threading.Condition()
+        self.max_wait = max_wait
+        self.outage_started = None
+        
+        self.outstanding = {client.host: 0 for client in self.clients}
+        self.requests = {client.host: 0 for client in self.clients}
+        self.ejected_until = {client.host: 0.0 for client in self.clients}
+        self.failures = {client.host: 0 for client in self.clients}
+    
+    def check_health(self, required_models=(), read_timeout=5):
+        """Health-check every host now, ejecting failures and re-adding the rest
+        
+        Returns {host: (healthy, message)}.
+        """
+        self.required_models = tuple(model for model in required_models if model)
+        status = {}
+        for client in self.clients:
+            healthy, message = check_host(client, self.required_models, read_timeout)
+            self.set_health(client, healthy)
+            status[client.host] = (healthy, message)
+        return status
+    
+    def set_health(self, client, healthy):
+        """Close a host's circuit after a passed health check, or keep it open"""
+        with self.condition:
+            self.ejected_until[client.host] = 0.0 if healthy else time.time() + self.eject_seconds
+            if healthy:
+                self.failures[client.host] = 0
+            self.condition.notify_all()
+    
+    def probe(self, client):
+        """Background health check of an ejected host whose ejection ran out"""
+        healthy, message = check_host(client, self.required_models)
+        self.set_health(client, healthy)
+        print(f"{'✅ Re-added' if healthy else '⚠️ Still ejected'}: {message}")
+    
+    def wait_available(self, timeout=None):
+        """Hosts whose circuit is closed, waiting while there are none
+        
+        Waits last until timeout (max_wait) seconds into the outage, so once
+        it has run that long every request fails fast until a host is back.
+        """
+        with self.condition:
+            while True:
+                now = time.time()
+                for client in self.clients:
+                    # Hosts stay out (until=inf) while their probe runs
+                    if 0.0 < self.ejected_until[client.host] <= now:
+                        self.ejected_until[client.host] = float('inf')
+                        threading.Thread(target=self.probe, args=(client,), daemon=True).start()
+                
+                candidates = [client for client in self.clients if self.ejected_until[client.host] == 0.0]
+                if candidates:
+                    self.outage_started = None
+                    return candidates
+                
+                if self.outage_started is None:
+                    self.outage_started = now
+                deadline = self.outage_started + (self.max_wait if timeout is None else timeout)
+                if now >= deadline:
+                    raise CircuitOpenError("Every Ollama host is ejected")
+                
+                # Wake when the next ejection runs out, a probe reports back or we give up
+                wake = min([until for until in self.ejected_until.values() if until != float('inf')] + [deadline])
+                self.condition.wait(wake - now)
+    
+    def acquire(self):
+        """Pick the available host with the fewest requests in flight"""
+        with self.condition:
+            candidates = self.wait_available()
+            
+            # Ties go to the host that has served least
+            client = min(candidates, key=lambda c: (self.outstanding[c.host], self.requests[c.host]))
+            self.outstanding[client.host] += 1
+            self.requests[client.host] += 1
+            return client
+    
+    def release(self, client, failed=False):
+        """Return a host after a request, opening its circuit after too many failures"""
+        with self.condition:
+            self.outstanding[client.host] -= 1
+            if not failed:
+                self.failures[client.host] = 0
+                return
+            
+            self.failures[client.host] += 1
+            if (self.failures[client.host] >= self.failure_threshold
+                    and self.ejected_until[client.host] == 0.0):
+                self.ejected_until[client.host] = time.time() + self.eject_seconds
+                print(f"⚠️ Ejected {client.host} for {self.eject_seconds}s "
+                      f"after {self.failures[client.host]} failures")
+    
+    @contextmanager
+    def host(self):
+        """Client of the host to send one request to
+        
+        Raise requests' HTTPError inside the block to count a 5xx reply
+        against the host.
+        """
+        client = self.acquire()
+        try:
+            yield client
+        except (requests.ConnectionError, requests.Timeout):
+            self.release(client, failed=True)
+            raise
+        except requests.HTTPError as e:
+            self.release(client, failed=e.response is not None and e.response.status_code >= 500)
+            raise
+        except BaseException:
+            self.release(client)
+            raise
+        else:
+            self.release(client)
+    
+    def stats(self):
+        """Requests sent to each host"""
+        with self.condition:
+            return dict(self.requests)
+
+class ConcurrencyLimiter:
+    def __init__(self, max_limit, initial_limit=1, min_limit=1, latency_tolerance=1.5,
+                 timeout_backoff=0.5, spike_backoff=0.75, smoothing=0.2):
+        """AIMD limit on requests in flight, between min_limit and max_limit
+        
+        Latency is tracked as a moving average (weight smoothing per request)
+        so single slow or fast questions don't count, against the lowest
+        average seen, which is relearned whenever the limit is at its floor.
+        The limit grows by one per limit's worth of requests while the average
+        stays within latency_tolerance of that baseline. A timeout or an
+        overload reply (429 or 503) multiplies it by timeout_backoff and a
+        latency spike by spike_backoff, at most
+        once per round of requests: ones started before the last backoff
+        can't cause another.
+        """
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(min(max(initial_limit, min_limit), max_limit))
+        self.latency_tolerance = latency_tolerance
+        self.timeout_backoff = timeout_backoff
+        self.spike_backoff = spike_backoff
+        self.smoothing = smoothing
+        self.average_latency = None
+        self.baseline_latency = None
+        self.last_backoff = 0.0
+        self.condition = threading.Condition()
+        
+        self.in_flight = 0
+        self.queued = 0
+        self.max_queued = 0
+        self.latencies = []
+    
+    @contextmanager
+    def slot(self):
+        """Wait for room under the limit, then hold a slot for one request
+        
+        Yields a function to call with the reply's HTTP status code, so
+        overload replies count even when they don't raise.
+        """
+        with self.condition:
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.queued -= 1
+            self.in_flight += 1
+        
+        started = time.time()
+        outcome = "error"
+        status_codes = []
+        try:
+            yield status_codes.append
+            overloaded = any(code in OVERLOAD_STATUS_CODES for code in status_codes)
+            outcome = "overload" if overloaded else "ok"
+        except requests.RequestException as e:
+            if is_timeout(e):
+                outcome = "timeout"
+            elif (isinstance(e, requests.HTTPError) and e.response is not None
+                    and e.response.status_code in OVERLOAD_STATUS_CODES):
+                outcome = "overload"
+            raise
+        finally:
+            self.record(started, time.time() - started, outcome)
+    
+    def backoff(self, started, factor):
+        """Cut the limit once for the round of requests a request started in"""
+        if started > self.last_backoff:
+            self.limit = max(self.min_limit, self.limit * factor)
+            self.last_backoff = time.time()
+    
+    def record(self, started, latency, outcome):
+        """Release a slot and adjust the limit for how its request went"""
+        with self.condition:
+            self.in_flight -= 1
+            
+            # Overload replies come back fast, so their latency would only mislead
+            if outcome in ("timeout", "overload"):
+                self.backoff(started, self.timeout_backoff)
+            elif outcome == "ok":
+                self.latencies.append(latency)
+                if self.average_latency is None:
+                    self.average_latency = latency
+                self.average_latency += self.smoothing * (latency - self.average_latency)
+                
+                # At the floor latency can't be our doing, so it is the new baseline
+                if self.baseline_latency is None or int(self.limit) <= self.min_limit:
+                    self.baseline_latency = self.average_latency
+                self.baseline_latency = min(self.baseline_latency, self.average_latency)
+                
+                if self.average_latency > self.baseline_latency * self.latency_tolerance:
+                    self.backoff(started, self.spike_backoff)
+                else:
+                    self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            
+            # Errors that never reached the server say nothing about its load
+            self.condition.notify_all()
+    
+    def stats(self):
+        """Current limit, requests in flight and waiting, and latency percentiles in seconds"""
+        with self.condition:
+            return {
+                "limit": int(self.limit),
+                "in_flight": self.in_flight,
+                "queue_depth": self.queued,
+                "max_queue_depth": self.max_queued,
+                "latency_p50": percentile(self.latencies, 0.5),
+                "latency_p95": percentile(self.latencies, 0.95)
+            }
+
+class ModelResidency:
+    def __init__(self, clients, keep_alive=-1, generate_path="/api/generate", load_timeout=300):
+        """Load models onto Ollama hosts before their first request and keep them there
+        
+        A model is preloaded on every host with an empty generate request the
+        first time it is needed, and pinned for keep_alive (an Ollama duration
+        such as "30m", seconds, or -1 until unloaded). release() unloads it so
+        the next stage's model doesn't have to evict it on a host that can't
+        hold both. Load and inference time are totalled per model from the
+        durations in Ollama's replies.
+        """
+        self.clients = list(clients)
+        self.keep_alive = keep_alive
+        self.generate_path = generate_path
+        self.load_timeout = load_timeout
+        self.loaded = set()
+        self.load_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.timings = {}
+    
+    def load(self, client, model, keep_alive):
+        """Send an empty request that loads (or with keep_alive 0, unloads) a model on one host"""
+        started = time.time()
+        try:
+            response = client.post(
+                self.generate_path, {"model": model, "keep_alive": keep_alive}, read_timeout=self.load_timeout
+            )
+            if response.status_code != 200:
+                print(f"⚠️ {client.host} could not load {model}: {response.status_code}")
+                return False
+            
+            reply = response.json()
+            if keep_alive != 0:
+                # Older servers don't report load_duration for an empty request
+                reply.setdefault("load_duration", (time.time() - started) * 1e9)
+                self.record(model, reply, request=False)
+            return True
+        except Exception as e:
+            print(f"⚠️ {client.host} could not load {model}: {e}")
+            return False
+    
+    def ensure_loaded(self, model):
+        """Preload a model on every host unless it already was; concurrent callers wait for it"""
+        if model in self.loaded:
+            return
+        
+        with self.load_lock:
+            if model in self.loaded:
+                return
+            
+            print(f"🔥 Loading {model} on {len(self.clients)} host(s)...")
+            with ThreadPoolExecutor(max_workers=len(self.clients)) as pool:
+                loaded = sum(pool.map(lambda client: self.load(client, model, self.keep_alive), self.clients))
+            
+            # Hosts that failed load the model with their first request instead
+            self.loaded.add(model)
+            print(f"✅ {model} resident on {loaded}/{len(self.clients)} host(s)")
+    
+    def release(self, model):
+        """Unload a model from every host"""
+        with self.load_lock:
+            for client in self.clients:
+                self.load(client, model, 0)
+            self.loaded.discard(model)
+    
+    def record(self, model, reply, request=True):
+        """Add the load and inference durations (in nanoseconds) of a finished reply"""
+        with self.lock:
+            timings = self.timings.setdefault(
+                model, {"load_seconds": 0.0, "inference_seconds": 0.0, "requests": 0}
+            )
+            timings["load_seconds"] += reply.get("load_duration", 0) / 1e9
+            timings["inference_seconds"] += (
+                reply.get("prompt_eval_duration", 0) + reply.get("eval_duration", 0)
+            ) / 1e9
+            timings["requests"] += request
+    
+    def stats(self):
+        """Total load and inference seconds, and per-model timings"""
+        with self.lock:
+            models = {model: dict(timings) for model, timings in self.timings.items()}
+        return {
+            "load_seconds": sum(timings["load_seconds"] for timings in models.values()),
+            "inference_seconds": sum(timings["inference_seconds"] for timings in models.values()),
+            "models": models
+        }
@@ -3,10 +3,19 @@ Complete Ollama Question Solver with WeasyPrint PDF Generation
 PRODUCTION VERSION - NO SIMULATION CODE
 """
 import os
+import re
+import time
 import base64
-import requests
+import random
+import hashlib
 import json
+import threading
+import requests
 from datetime import datetime
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+from ollama_client import CircuitOpenError, ConcurrencyLimiter, ModelResidency, OllamaPool, host_of
+from result_cache import ResultCache
 
 # Try WeasyPrint import
 try:
@@ -16,14 +25,80 @@ except ImportError:
     WEASYPRINT_AVAILABLE = False
     print("⚠️ WeasyPrint not available. Install with: pip install weasyprint")
 
+def write_atomic(path, text):
+    """Write a text file so readers see the old or the new contents, never a torn write"""
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
 class OllamaDeepSeekSolver:
     def __init__(self, images_dir='temp', latex_dir='latex_pages', 
                  ollama_url='http://localhost:11434/api/generate', 
-                 model_name='llama3.1:8b'):
+                 model_name='llama3.1:8b', text_model_name=None, concurrency=1,
+                 connect_timeout=5, read_timeout=120, stream=False, keep_partial_answers=True,
+                 cache_dir="cache", solution_cache_size=256 * 1024 * 1024,
+                 ollama_urls=None, eject_seconds=30, failure_threshold=3,
+                 max_retries=3, retry_base_delay=1.0, retry_max_delay=30.0, resume=True,
+                 keep_alive=-1):
+        """Set up the solver
+        
+        text_model_name: model for questions without figures, solved from their text
+        concurrency: most requests in flight per host; match OLLAMA_NUM_PARALLEL
+        connect_timeout, read_timeout: seconds; with stream, read_timeout is per chunk
+        stream, keep_partial_answers: write answers as they arrive, keeping cut-off ones
+        cache_dir, solution_cache_size: persistent solution cache (None disables it)
+        ollama_urls: several hosts to balance over instead of ollama_url
+        eject_seconds, failure_threshold: per-host circuit breaker (see OllamaPool)
+        max_retries, retry_base_delay, retry_max_delay: jittered backoff for transient failures
+        resume: skip questions already solved from the same inputs (manifest.json)
+        keep_alive: how long Ollama keeps each preloaded model resident (-1 for good)
+        """
         self.images_dir = images_dir
         self.latex_dir = latex_dir
         self.ollama_url = ollama_url
         self.model_name = model_name
+        self.text_model_name = text_model_name
+        self.concurrency = max(1, concurrency)
+        self.read_timeout = read_timeout
+        self.stream = stream
+        self.keep_partial_answers = keep_partial_answers
+        self.generation_stats = {}
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.retries = 0
+        self.retries_lock = threading.Lock()
+        self.dead_letter_path = os.path.join(latex_dir, "dead_letters.json")
+        self.dead_letters = []
+        self.resume = resume
+        self.manifest_path = os.path.join(latex_dir, "manifest.json")
+        self.manifest = {}
+        self.manifest_lock = threading.Lock()
+        self.resumed = 0
+        self.solution_cache = None
+        if cache_dir:
+            self.solution_cache = ResultCache(os.path.join(cache_dir, "solutions.sqlite"), solution_cache_size)
+        ollama_urls = ollama_urls or [ollama_url]
+        self.ollama = OllamaPool(
+            [host_of(url) for url in ollama_urls], self.concurrency + 1, connect_timeout,
+            eject_seconds, failure_threshold,
+            # An outage shorter than this many ejections delays questions without failing them
+            max_wait=eject_seconds * (max_retries + 1)
+        )
+        # Hosts may be listed without the endpoint, e.g. http://gpu-2:11434
+        self.generate_path = urlsplit(ollama_urls[0]).path.rstrip("/") or "/api/generate"
+        self.residency = ModelResidency(self.ollama.clients, keep_alive, self.generate_path)
+        self.limiter = ConcurrencyLimiter(
+            max_limit=self.concurrency * len(ollama_urls), initial_limit=len(ollama_urls)
+        )
+        self.generate_options = {
+            "temperature": 0.1,
+            "top_p": 0.9,
+            "num_predict": 4000
+        }
         
         # Create directories
         os.makedirs(self.latex_dir, exist_ok=True)
@@ -31,35 +106,47 @@ class OllamaDeepSeekSolver:
             os.makedirs(self.images_dir, exist_ok=True)
     
     def check_ollama_connection(self):
-        """Check if Ollama is running and model is available"""
+        """Check that Ollama hosts are running with the models, ejecting those that aren't"""
+        status = self.ollama.check_health([self.model_name, self.text_model_name])
+        healthy = [host for host, (ok, message) in status.items() if ok]
+        for host, (ok, message) in status.items():
+            if not ok:
+                print(f"⚠️ {message}")
+        
+        if healthy:
+            return True, f"✅ Connected to Ollama with {self.model_name} on {len(healthy)}/{len(status)} hosts"
+        return False, "❌ No Ollama host available: " + "; ".join(message for ok, message in status.values())
+    
+    def read_image(self, image_path):
+        """Read an image file's bytes, or None if it can't be read"""
         try:
-            response = requests.get("http://localhost:11434/api/tags", timeout=5)
-            if response.status_code == 200:
-                models = response.json().get('models', [])
-                model_names = [m['name'] for m in models]
-                if self.model_name in model_names:
-                    return True, f"✅ Connected to Ollama with {self.model_name}"
-                else:
-                    return False, f"❌ Model {self.model_name} not found. Available: {model_names}"
-            return False, "❌ Ollama not responding"
+            with open(image_path, 'rb') as f:
+                return f.read()
         except Exception as e:
-            return False, f"❌ Connection failed: {e}"
+            print(f"Error reading image {image_path}: {e}")
+            return None
     
-    def encode_image_base64(self, image_path):
-        """Convert image to base64 for Ollama vision"""
+    def encode_image_base64(self, image_path, image_bytes=None):
+        """Convert image to base64 for Ollama vision, from memory when its bytes are given"""
         try:
+            if image_bytes is not None:
+                return base64.b64encode(image_bytes).decode('utf-8')
             with open(image_path, 'rb') as f:
                 return base64.b64encode(f.read()).decode('utf-8')
         except Exception as e:
             print(f"Error encoding image {image_path}: {e}")
             return None
     
-    def send_image_to_ollama(self, image_path, question_number):
-        """Send image to Ollama for detailed solution"""
-        prompt = f"""You are the world's best mathematics and statistics tutor. Analyze this question image and provide a complete solution.
+    def build_prompt(self, question_number, question_text=None):
+        """Solution prompt for a question image, or for the question's text when given"""
+        if question_text:
+            source, extract = "the question below", "Restate the exact question text"
+        else:
+            source, extract = "this question image", "Extract the exact question text from the image"
+        prompt = f"""You are the world's best mathematics and statistics tutor. Analyze {source} and provide a complete solution.
 
 REQUIREMENTS:
-1. Extract the exact question text from the image
+1. {extract}
 2. Provide detailed step-by-step solution
 3. Include all formulas and calculations
 4. For multiple choice, identify the correct answer
@@ -79,38 +166,335 @@ Answer: [Final answer with units]
 Key Concepts: [List important concepts]
 
 Use clear mathematical notation."""
-
-        # Encode image for Ollama
-        base64_img = self.encode_image_base64(image_path)
-        if not base64_img:
-            return None
         
+        if question_text:
+            prompt += f"\n\nQuestion:\n{question_text}"
+        return prompt
+    
+    def generate(self, model_name, prompt, images=None, output_path=None, question_number=None):
+        """Run one generation, retrying transient failures, and return the response text or None
+        
+        In streaming mode the text is also written to output_path as it arrives.
+        """
         payload = {
-            "model": self.model_name,
+            "model": model_name,
             "prompt": prompt,
-            "keep_alive": -1,
-            "images": [base64_img],
-            "stream": False,
-            "options": {
-                "temperature": 0.1,
-                "top_p": 0.9,
-                "num_predict": 4000
-            }
+            "keep_alive": self.residency.keep_alive,
+            "stream": self.stream,
+            "options": self.generate_options
         }
+        if images:
+            payload["images"] = images
         
+        self.residency.ensure_loaded(model_name)
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                delay = self.retry_delay(attempt)
+                print(f"🔁 Retrying question {question_number} ({attempt}/{self.max_retries}) in {delay:.1f}s")
+                with self.retries_lock:
+                    self.retries += 1
+                time.sleep(delay)
+            
+            final = attempt == self.max_retries
+            if self.stream:
+                content, retry = self.generate_streaming(payload, output_path, question_number, final)
+            else:
+                content, retry = self.generate_once(payload)
+            if not retry:
+                break
+        
+        return content
+    
+    def retry_delay(self, attempt):
+        """Full-jitter exponential backoff before the attempt-th retry"""
+        return random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * 2 ** (attempt - 1)))
+    
+    def generate_once(self, payload):
+        """One non-streaming attempt, returning (response text or None, whether to retry)"""
         try:
-            response = requests.post(self.ollama_url, json=payload, timeout=120)
+            # Waiting out an outage must not hold a slot or count as latency
+            self.ollama.wait_available()
+            with self.limiter.slot() as report_status, self.ollama.host() as client:
+                response = client.post(self.generate_path, payload, read_timeout=self.read_timeout)
+                report_status(response.status_code)
+                if response.status_code >= 500:
+                    response.raise_for_status()
+            
             if response.status_code == 200:
                 result = response.json()
-                return result.get("response", "")
+                self.residency.record(payload["model"], result)
+                content = result.get("response", "")
+                if not content.strip():
+                    print("Ollama returned an empty answer")
+                    return None, True
+                return content, False
             else:
                 print(f"Ollama API error: {response.status_code}")
-                return None
+                return None, response.status_code == 429
+        except CircuitOpenError as e:
+            # The outage already outlasted every retry's worth of waiting
+            print(f"Ollama request failed: {e}")
+            return None, False
+        except requests.RequestException as e:
+            print(f"Ollama request failed: {e}")
+            return None, True
         except Exception as e:
-            print(f"Failed to connect to Ollama: {e}")
+            print(f"Bad reply from Ollama: {e}")
+            return None, False
+    
+    def generate_streaming(self, payload, output_path, question_number, final=True):
+        """Consume Ollama's NDJSON chunks, appending each to output_path as it arrives
+        
+        Records time to first token and whether the answer was cut off in
+        generation_stats. Returns (text, whether to retry): the text received,
+        or None if the answer is incomplete and is retried or partial answers
+        aren't kept.
+        """
+        started = time.time()
+        first_token = None
+        done = False
+        transient = False
+        chunks = []
+        output = open(output_path, 'w', encoding='utf-8') if output_path else None
+        
+        try:
+            # Waiting out an outage must not hold a slot or count as latency
+            self.ollama.wait_available()
+            with self.limiter.slot() as report_status, self.ollama.host() as client, client.post(
+                    self.generate_path, payload, read_timeout=self.read_timeout, stream=True) as response:
+                report_status(response.status_code)
+                if response.status_code >= 500:
+                    response.raise_for_status()
+                
+                if response.status_code != 200:
+                    print(f"Ollama API error: {response.status_code}")
+                    transient = response.status_code == 429
+                else:
+                    for line in response.iter_lines():
+                        if not line:
+                            continue
+                        
+                        chunk = json.loads(line)
+                        if "error" in chunk:
+                            print(f"Ollama stream error: {chunk['error']}")
+                            break
+                        
+                        text = chunk.get("response", "")
+                        if text:
+                            if first_token is None:
+                                first_token = time.time() - started
+                            chunks.append(text)
+                            if output:
+                                output.write(text)
+                                output.flush()
+                        
+                        if chunk.get("done"):
+                            self.residency.record(payload["model"], chunk)
+                            done = True
+                            break
+        except CircuitOpenError as e:
+            print(f"Ollama stream interrupted: {e}")
+        except requests.RequestException as e:
+            print(f"Ollama stream interrupted: {e}")
+            transient = True
+        except Exception as e:
+            print(f"Ollama stream interrupted: {e}")
+        finally:
+            if output:
+                output.close()
+        
+        content = "".join(chunks)
+        self.generation_stats[question_number] = {
+            "time_to_first_token": first_token,
+            "seconds": time.time() - started,
+            "partial": not done
+        }
+        
+        if done and content.strip():
+            return content, False
+        if done:
+            print(f"Ollama returned an empty answer for question {question_number}")
+            transient = True
+        
+        retry = transient and not final
+        if content.strip() and self.keep_partial_answers and not retry:
+            print(f"⚠️ Kept partial answer for question {question_number} ({len(content)} chars)")
+            return content, False
+        
+        if output_path and os.path.exists(output_path):
+            os.remove(output_path)
+        return None, retry
+    
+    def send_image_to_ollama(self, image_path, question_number, image_bytes=None, output_path=None):
+        """Send image to Ollama for detailed solution"""
+        # Encode image for Ollama
+        base64_img = self.encode_image_base64(image_path, image_bytes)
+        if not base64_img:
             return None
+        
+        return self.generate(self.model_name, self.build_prompt(question_number), [base64_img],
+                             output_path, question_number)
+    
+    def send_text_to_ollama(self, question_text, question_number, output_path=None):
+        """Send a question's text to the text model for detailed solution"""
+        return self.generate(self.text_model_name, self.build_prompt(question_number, question_text),
+                             None, output_path, question_number)
+    
+    def solve_question(self, question_number, img_path, img_bytes, question_text, output_path=None):
+        """Solve from text when routed to the text model, from the image otherwise"""
+        if question_text:
+            return self.send_text_to_ollama(question_text, question_number, output_path)
+        return self.send_image_to_ollama(img_path, question_number, img_bytes, output_path)
     
-    def process_all_images(self):
+    def solution_cache_key(self, img_bytes, question_text):
+        """Cache key covering everything that determines a question's solution
+        
+        The prompt template is keyed without the question number, so a question
+        repeated at another position in another paper still hits; see
+        renumber_answer.
+        """
+        if question_text:
+            return ResultCache.make_key(
+                None, self.text_model_name, self.build_prompt(0, question_text), self.generate_options
+            )
+        return ResultCache.make_key(
+            hashlib.sha256(img_bytes).hexdigest(), self.model_name,
+            self.build_prompt(0), self.generate_options
+        )
+    
+    def renumber_answer(self, content, question_number):
+        """Relabel the leading 'Question N:' of a cached answer with this question's number"""
+        return re.sub(r'^(\s*)Question\s+\d+\s*:', rf'\g<1>Question {question_number}:', content, count=1)
+    
+    def question_fingerprint(self, img_bytes, question_text):
+        """What an answer was solved from: input hash, model, prompt template and options"""
+        if question_text:
+            input_hash = hashlib.sha256(question_text.encode('utf-8')).hexdigest()
+            model_name = self.text_model_name
+        else:
+            input_hash = hashlib.sha256(img_bytes).hexdigest()
+            model_name = self.model_name
+        
+        return {
+            "input_hash": input_hash,
+            "model": model_name,
+            "prompt_hash": hashlib.sha256(self.build_prompt(0, question_text).encode('utf-8')).hexdigest(),
+            "options": self.generate_options
+        }
+    
+    def load_manifest(self):
+        """Load the checkpoint manifest of completed answers in latex_dir"""
+        self.manifest = {}
+        if not os.path.exists(self.manifest_path):
+            return
+        
+        try:
+            with open(self.manifest_path, encoding='utf-8') as f:
+                self.manifest = json.load(f).get("questions", {})
+        except Exception as e:
+            print(f"⚠️ Ignoring unreadable manifest {self.manifest_path}: {e}")
+    
+    def is_checkpointed(self, filename, fingerprint):
+        """Whether an answer file exists and was solved from the same inputs"""
+        with self.manifest_lock:
+            entry = self.manifest.get(filename)
+        file_path = os.path.join(self.latex_dir, filename)
+        if not entry or not os.path.exists(file_path) or not os.path.getsize(file_path):
+            return False
+        return all(entry.get(key) == value for key, value in fingerprint.items())
+    
+    def checkpoint(self, filename, question_number, img_file, fingerprint):
+        """Record a completed answer in the manifest"""
+        with self.manifest_lock:
+            self.manifest[filename] = {
+                "question_number": question_number,
+                "image": img_file,
+                **fingerprint,
+                "solved_at": datetime.now().isoformat(timespec='seconds')
+            }
+            write_atomic(self.manifest_path, json.dumps({"questions": self.manifest}, indent=2))
+    
+    def solve_numbered(self, job):
+        """Solve the question_number-th (filename, path, bytes, text) question
+        
+        Returns the path of its Q###.txt answer file, or None if it failed.
+        """
+        question_number, (img_file, img_path, img_bytes, question_text) = job
+        
+        filename = f"Q{question_number:03d}_{os.path.splitext(img_file)[0]}.txt"
+        file_path = os.path.join(self.latex_dir, filename)
+        
+        if (self.solution_cache or self.resume) and img_bytes is None and not question_text:
+            img_bytes = self.read_image(img_path)
+            if img_bytes is None:
+                return None
+        
+        fingerprint = None
+        if self.resume:
+            fingerprint = self.question_fingerprint(img_bytes, question_text)
+            if self.is_checkpointed(filename, fingerprint):
+                with self.manifest_lock:
+                    self.resumed += 1
+                return file_path
+        
+        print(f"🧠 Processing {question_number}: {img_file}")
+        
+        cache_key = None
+        if self.solution_cache:
+            cache_key = self.solution_cache_key(img_bytes, question_text)
+            content = self.solution_cache.get(cache_key)
+            # A blank answer is never a usable hit
+            if content and content.strip():
+                write_atomic(file_path, self.renumber_answer(content, question_number))
+                if fingerprint:
+                    self.checkpoint(filename, question_number, img_file, fingerprint)
+                return file_path
+        
+        content = self.solve_question(question_number, img_path, img_bytes, question_text, file_path)
+        if not content or not content.strip():
+            return None
+        
+        # Streamed answers are already in their file
+        if not self.stream:
+            write_atomic(file_path, content)
+        
+        # Answers cut off mid-stream are kept but never cached or checkpointed,
+        # so a rerun solves them again
+        if not self.generation_stats.get(question_number, {}).get("partial"):
+            if cache_key:
+                self.solution_cache.put(cache_key, content)
+            if fingerprint:
+                self.checkpoint(filename, question_number, img_file, fingerprint)
+        
+        return file_path
+    
+    def route_text(self, question):
+        """Question text to solve from, or None if the question needs its image"""
+        if not self.text_model_name or question.get('has_figure', True):
+            return None
+        return question.get('question_body') or None
+    
+    def collect_images(self, questions=None):
+        """List (filename, path, bytes, text) for each question
+        
+        Question records from QuestionExtractor.process_pdf are used as given,
+        including any in-memory 'image_bytes' and, for questions routed to the
+        text model, their text; otherwise images_dir is scanned.
+        """
+        if questions is not None:
+            return [(question['filename'], question.get('file_path'), question.get('image_bytes'),
+                     self.route_text(question))
+                    for question in questions]
+        
+        if not os.path.exists(self.images_dir):
+            print(f"❌ Images directory '{self.images_dir}' not found!")
+            return []
+        
+        image_files = sorted([f for f in os.listdir(self.images_dir) 
+                            if f.lower().endswith(('.png', '.jpg', '.jpeg', '.webp'))])
+        return [(f, os.path.join(self.images_dir, f), None, None) for f in image_files]
+    
+    def process_all_images(self, questions=None):
         """Process all question images using Ollama"""
         print("🚀 Starting question processing...")
         
@@ -122,41 +506,142 @@ Use clear mathematical notation."""
             print("❌ Ollama not available - cannot process images")
             return []
         
-        # Check images directory
-        if not os.path.exists(self.images_dir):
-            print(f"❌ Images directory '{self.images_dir}' not found!")
-            return []
-        
-        image_files = sorted([f for f in os.listdir(self.images_dir) 
-                            if f.lower().endswith('.png')])
+        image_files = self.collect_images(questions)
         
         if not image_files:
-            print("❌ No PNG images found in images directory")
+            print("❌ No question images found in images directory")
             return []
         
         print(f"📸 Found {len(image_files)} question images to process")
+        text_count = sum(1 for image in image_files if image[3])
+        if text_count:
+            print(f"📝 {text_count} questions without figures go to {self.text_model_name} as text")
         
-        content_files = []
-        for i, img_file in enumerate(image_files, 1):
-            img_path = os.path.join(self.images_dir, img_file)
-            print(f"🧠 Processing {i}/{len(image_files)}: {img_file}")
-            
-            content = self.send_image_to_ollama(img_path, i)
-            
-            if content:
-                filename = f"Q{i:03d}_{img_file[:-4]}.txt"
-                file_path = os.path.join(self.latex_dir, filename)
+        return self.process_jobs(list(enumerate(image_files, 1)))
+    
+    def job_model(self, job):
+        """Model a numbered question job is solved by"""
+        return self.text_model_name if job[1][3] else self.model_name
+    
+    def process_jobs(self, jobs, solved_files=None):
+        """Solve numbered questions concurrently, dead-lettering the ones that fail
+        
+        solved_files maps question numbers to answers already solved in the
+        same run, when replaying its dead letters. Returns the run's content
+        files in Q### order.
+        """
+        in_flight = self.limiter.max_limit
+        if in_flight > 1:
+            print(f"⚡ Keeping up to {in_flight} requests in flight")
+        
+        self.generation_stats = {}
+        self.retries = 0
+        self.resumed = 0
+        if self.resume:
+            self.load_manifest()
+        
+        # One stage per model, so a host that can't hold both models doesn't
+        # swap them back and forth between questions
+        stages = {}
+        for job in jobs:
+            stages.setdefault(self.job_model(job), []).append(job)
+        
+        solved = {}
+        with ThreadPoolExecutor(max_workers=in_flight) as pool:
+            for stage, (model_name, stage_jobs) in enumerate(stages.items(), 1):
+                if len(stages) > 1:
+                    print(f"🎬 Stage {stage}/{len(stages)}: {len(stage_jobs)} questions on {model_name}")
                 
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    f.write(content)
+                for job, file_path in zip(stage_jobs, pool.map(self.solve_numbered, stage_jobs)):
+                    solved[job[0]] = file_path
+                    if file_path:
+                        print(f"✅ Saved: {os.path.basename(file_path)}")
+                    else:
+                        print(f"❌ Failed to process: {job[1][0]}")
                 
-                content_files.append(file_path)
-                print(f"✅ Saved: {filename}")
-            else:
-                print(f"❌ Failed to process: {img_file}")
+                if stage < len(stages) and model_name in self.residency.loaded:
+                    self.residency.release(model_name)
+        
+        # Content files stay in Q### order whatever the stage order
+        solved_files = dict(solved_files or {})
+        solved_files.update((number, file_path) for number, file_path in solved.items() if file_path)
+        content_files = [solved_files[number] for number in sorted(solved_files)]
+        failed_jobs = [job for job in jobs if not solved[job[0]]]
+        
+        if self.resumed:
+            print(f"⏭️ {self.resumed} questions already solved in an earlier run")
         
+        self.save_dead_letters(failed_jobs, solved_files)
         return content_files
     
+    def save_dead_letters(self, jobs, solved_files):
+        """Record questions that failed every attempt in dead_letters.json
+        
+        The run's solved answer files are recorded with them, so a replay
+        rebuilds exactly this run's PDF. Images that only exist in memory are
+        written next to it so a later run can replay them.
+        """
+        self.dead_letters = jobs
+        if not jobs:
+            if os.path.exists(self.dead_letter_path):
+                os.remove(self.dead_letter_path)
+            return
+        
+        entries = []
+        for question_number, (img_file, img_path, img_bytes, question_text) in jobs:
+            if not img_path and img_bytes is not None:
+                img_path = os.path.join(self.latex_dir, "dead_letters", img_file)
+                os.makedirs(os.path.dirname(img_path), exist_ok=True)
+                with open(img_path, 'wb') as f:
+                    f.write(img_bytes)
+            
+            entries.append({
+                "question_number": question_number,
+                "filename": img_file,
+                "image_path": img_path,
+                "question_text": question_text
+            })
+        
+        solved = {str(number): os.path.basename(file_path) for number, file_path in solved_files.items()}
+        write_atomic(self.dead_letter_path, json.dumps({"solved": solved, "questions": entries}, indent=2))
+        print(f"📮 {len(jobs)} failed questions saved to {self.dead_letter_path}")
+    
+    def load_dead_letters(self):
+        """Numbered question jobs recorded in dead_letters.json, and the run's solved answer files"""
+        if not os.path.exists(self.dead_letter_path):
+            return [], {}
+        
+        with open(self.dead_letter_path, encoding='utf-8') as f:
+            record = json.load(f)
+        jobs = [
+            (entry["question_number"], (entry["filename"], entry["image_path"], None, entry["question_text"]))
+            for entry in record["questions"]
+        ]
+        solved_files = {
+            int(number): os.path.join(self.latex_dir, filename)
+            for number, filename in record["solved"].items()
+            if os.path.exists(os.path.join(self.latex_dir, filename))
+        }
+        return jobs, solved_files
+    
+    def replay_dead_letters(self):
+        """Solve only the dead-lettered questions of an earlier run
+        
+        Returns that run's content files, solved then or now, in Q### order.
+        """
+        print("🔁 Replaying failed questions...")
+        
+        connected, message = self.check_ollama_connection()
+        print(message)
+        
+        if not connected:
+            print("❌ Ollama not available - cannot process images")
+            return []
+        
+        jobs, solved_files = self.load_dead_letters()
+        print(f"📮 {len(jobs)} failed questions to replay")
+        return self.process_jobs(jobs, solved_files)
+    
     def convert_to_html_pdf(self, content_files):
         """Convert content to PDF using WeasyPrint - NO PDFLATEX REQUIRED"""
         print("🔄 Converting to PDF using WeasyPrint...")
@@ -297,13 +782,21 @@ Use clear mathematical notation."""
             print(f"❌ WeasyPrint conversion failed: {e}")
             return None
     
-    def run_complete_workflow(self):
-        """Execute the complete workflow"""
+    def run_complete_workflow(self, questions=None, replay_dead_letters=False):
+        """Execute the complete workflow, on extracted question records if given
+        
+        replay_dead_letters solves only the questions an earlier run failed,
+        then builds the PDF from all answers.
+        """
         print("🎯 STARTING COMPLETE WORKFLOW")
         print("=" * 60)
         
         # Step 1: Process images with Ollama
-        content_files = self.process_all_images()
+        cache_before = self.solution_cache.stats() if self.solution_cache else None
+        if replay_dead_letters:
+            content_files = self.replay_dead_letters()
+        else:
+            content_files = self.process_all_images(questions)
         
         if not content_files:
             print("❌ No content generated from images")
@@ -321,11 +814,39 @@ Use clear mathematical notation."""
             print(f"🎓 Open PDF: {pdf_path}")
             print("=" * 60)
             
+            first_tokens = [stats["time_to_first_token"] for stats in self.generation_stats.values()
+                            if stats["time_to_first_token"] is not None]
+            
+            limiter_stats = self.limiter.stats()
+            residency_stats = self.residency.stats()
+            cache_hits = cache_misses = 0
+            if self.solution_cache:
+                cache_after = self.solution_cache.stats()
+                cache_hits = cache_after["hits"] - cache_before["hits"]
+                cache_misses = cache_after["misses"] - cache_before["misses"]
+            
             return {
                 "pdf_path": pdf_path,
                 "latex_dir": self.latex_dir,
                 "total_questions": len(content_files),
-                "format": "PDF"
+                "format": "PDF",
+                "partial_answers": sum(1 for stats in self.generation_stats.values() if stats["partial"]),
+                "time_to_first_token": sum(first_tokens) / len(first_tokens) if first_tokens else None,
+                "solution_cache_hits": cache_hits,
+                "solution_cache_misses": cache_misses,
+                "solution_cache_hit_rate": cache_hits / (cache_hits + cache_misses) if cache_hits + cache_misses else 0.0,
+                "host_requests": self.ollama.stats(),
+                "retries": self.retries,
+                "resumed": self.resumed,
+                "dead_letters": len(self.dead_letters),
+                "concurrency_limit": limiter_stats["limit"],
+                "queue_depth": limiter_stats["queue_depth"],
+                "max_queue_depth": limiter_stats["max_queue_depth"],
+                "latency_p50": limiter_stats["latency_p50"],
+                "latency_p95": limiter_stats["latency_p95"],
+                "model_load_seconds": residency_stats["load_seconds"],
+                "inference_seconds": residency_stats["inference_seconds"],
+                "model_timings": residency_stats["models"]
             }
         else:
             print("❌ PDF generation failed")
@@ -5,31 +5,334 @@ Structure-aware PDF question extractor + AI solver
 
 import os
 import fitz  # PyMuPDF
-import requests
+from PIL import Image
 import json
 import re
 import datetime
 import base64
+import io
+import shutil
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from result_cache import ResultCache, hash_file
+from ollama_client import DEFAULT_HOST, ConcurrencyLimiter, ModelResidency, get_client
+
+# File extension for each image output format
+IMAGE_EXTENSIONS = {"png": "png", "jpeg": "jpg", "webp": "webp"}
+
+# Lookup table marking pixels darker than near-white as ink
+INK_TABLE = [255 if value < 240 else 0 for value in range(256)]
+
+def has_ink(color):
+    """Whether a drawing color (RGB floats, or None) would be visible on white paper"""
+    return color is not None and min(color) < 240 / 255
+
+# Document and render options set up once per render worker process
+worker_document = None
+worker_render_options = None
+
+def stitch_pixmaps(pixmaps):
+    """Stack pixmaps vertically on a white canvas"""
+    width = max(pix.width for pix in pixmaps)
+    height = sum(pix.height for pix in pixmaps)
+    
+    stitched = fitz.Pixmap(pixmaps[0].colorspace, fitz.IRect(0, 0, width, height), pixmaps[0].alpha)
+    stitched.clear_with(255)
+    
+    y = 0
+    for pix in pixmaps:
+        pix.set_origin(0, y)
+        stitched.copy(pix, pix.irect)
+        y += pix.height
+    
+    return stitched
+
+def segments_zoom(segments, render_options):
+    """Zoom for a set of regions, capped so the stitched image fits max_side pixels"""
+    zoom = render_options.get("zoom", 2.5)
+    max_side = render_options.get("max_side")
+    if not max_side:
+        return zoom
+    
+    width = max(clip_rect.width for page, clip_rect in segments)
+    height = sum(clip_rect.height for page, clip_rect in segments)
+    long_side = max(width, height)
+    if long_side <= 0:
+        return zoom
+    
+    # Pixmap sizes round outwards, so leave room for a pixel per segment
+    return min(zoom, (max_side - len(segments)) / long_side)
+
+def trim_pixmap(pix, margin):
+    """Crop a pixmap to its ink bounding box plus margin pixels"""
+    mode = "L" if pix.n == 1 else "RGB"
+    image = Image.frombuffer(mode, (pix.width, pix.height), pix.samples_mv, "raw", mode, 0, 1)
+    if mode != "L":
+        image = image.convert("L")
+    
+    ink_bbox = image.point(INK_TABLE).getbbox()
+    if not ink_bbox:
+        return pix
+    
+    left, top, right, bottom = ink_bbox
+    x0, y0 = pix.x, pix.y
+    trimmed_rect = fitz.IRect(
+        max(0, left - margin) + x0, max(0, top - margin) + y0,
+        min(pix.width, right + margin) + x0, min(pix.height, bottom + margin) + y0
+    )
+    if trimmed_rect == pix.irect:
+        return pix
+    
+    trimmed = fitz.Pixmap(pix.colorspace, trimmed_rect, pix.alpha)
+    trimmed.copy(pix, trimmed_rect)
+    return trimmed
+
+def encode_pixmap(pix, render_options):
+    """Encode a pixmap as PNG, palette PNG, JPEG or WebP bytes per the render options"""
+    image_format = render_options.get("format", "png")
+    colors = render_options.get("colors")
+    
+    if image_format == "png" and not colors:
+        return pix.tobytes("png")
+    
+    image = Image.frombytes("L" if pix.n == 1 else "RGB", (pix.width, pix.height), pix.samples)
+    buffer = io.BytesIO()
+    if image_format == "png":
+        # Two colors give a 1-bit PNG
+        image.quantize(colors=colors).save(buffer, format="PNG", optimize=True)
+    else:
+        image.save(buffer, format=image_format.upper(), quality=render_options.get("quality", 85))
+    
+    return buffer.getvalue()
+
+def render_segments(segments, output_path, render_options=None, image_info=None, measure_png=False):
+    """Render (page, clip) regions to one image, stitched top to bottom
+    
+    The encoded image is written to output_path unless that is None.
+    Returns the encoded bytes, or None if rendering failed. A dict passed as
+    image_info gets the image's width, height and encoded bytes, and
+    png_bytes, its size as a default RGB PNG, if that is the output format
+    or measure_png is set.
+    """
+    render_options = render_options or {}
+    try:
+        # High-quality rendering, scaled down to the pixel budget if one is set
+        zoom = segments_zoom(segments, render_options)
+        mat = fitz.Matrix(zoom, zoom)
+        colorspace = fitz.csGRAY if render_options.get("colorspace") == "gray" else fitz.csRGB
+        pixmaps = [
+            page.get_pixmap(matrix=mat, clip=clip_rect, colorspace=colorspace)
+            for page, clip_rect in segments
+        ]
+        pix = pixmaps[0] if len(pixmaps) == 1 else stitch_pixmaps(pixmaps)
+        
+        # Drop blank margins around the ink
+        if render_options.get("trim_margin") is not None:
+            pix = trim_pixmap(pix, render_options["trim_margin"])
+        
+        # Encode and save image
+        image_data = encode_pixmap(pix, render_options)
+        if image_info is not None:
+            image_info.update(width=pix.width, height=pix.height, bytes=len(image_data))
+            # Savings are reported against the default 24-bit RGB PNG, which
+            # costs a second encode unless it's what was written
+            if pix.n == 3 and render_options.get("format", "png") == "png" and not render_options.get("colors"):
+                image_info["png_bytes"] = len(image_data)
+            elif measure_png:
+                image_info["png_bytes"] = len(fitz.Pixmap(fitz.csRGB, pix).tobytes("png"))
+        pix = None
+        
+        if output_path:
+            with open(output_path, 'wb') as f:
+                f.write(image_data)
+        
+        return image_data
+        
+    except Exception as e:
+        print(f"Image extraction failed: {e}")
+        return None
+
+def render_clip(page, clip_rect, output_path, render_options=None):
+    """Render a page region to an image file, returning its bytes or None"""
+    return render_segments([(page, clip_rect)], output_path, render_options)
+
+def run_render_job(doc, job, render_options):
+    """Render a ([(page number, clip), ...], output path, return bytes, measure PNG) job
+    
+    Returns the image bytes if asked for them, otherwise whether it
+    succeeded, and the image info from render_segments.
+    """
+    segments, output_path, return_bytes, measure_png = job
+    image_info = {}
+    image_data = render_segments(
+        [(doc[page_num], fitz.Rect(clip)) for page_num, clip in segments],
+        output_path,
+        render_options,
+        image_info,
+        measure_png
+    )
+    return (image_data if return_bytes else image_data is not None), image_info
+
+def link_file(source, target):
+    """Hard-link source to target, copying where a link isn't possible"""
+    if os.path.exists(target):
+        os.unlink(target)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+def open_worker_document(pdf_path, render_options):
+    """Render pool initializer: open the PDF once for this worker"""
+    global worker_document, worker_render_options
+    worker_document = fitz.open(pdf_path)
+    worker_render_options = render_options
+
+def render_job_shard(jobs):
+    """Render a shard of render jobs in a worker"""
+    return [run_render_job(worker_document, job, worker_render_options) for job in jobs]
 
 class QuestionExtractor:
-    def __init__(self, model_name="llama3.2:1b", output_dir="temp"):
-        """Initialize the question extractor"""
+    def __init__(self, model_name="llama3.2:1b", output_dir="temp", render_workers=1,
+                 textpage_cache_size=8, cache_dir="cache", ai_cache_size=64 * 1024 * 1024,
+                 render_cache_size=512 * 1024 * 1024,
+                 max_image_side=None, archive_dir=None, archive_zoom=4.0,
+                 image_format="png", image_colorspace="rgb", image_colors=None, image_quality=85,
+                 trim_margin=12, write_images=True, keep_image_bytes=False, measure_savings=False,
+                 ollama_host=DEFAULT_HOST, http_pool_size=8, connect_timeout=5, keep_alive="5m"):
+        """Initialize the question extractor
+        
+        model_name: Ollama model for the AI question-text fallback
+        render_workers: processes rendering question images (1 renders in-process)
+        textpage_cache_size: parsed page text layers kept in memory
+        cache_dir, ai_cache_size, render_cache_size: AI and render caches (None disables them)
+        max_image_side: cap on the long side of question images, in pixels
+        archive_dir, archive_zoom: also write full-color archive renders at this zoom
+        image_format, image_quality: "png", "jpeg" or "webp", and lossy quality
+        image_colorspace, image_colors: "rgb" or "gray", and palette PNG colors (2 for 1-bit)
+        trim_margin: pixels kept around the ink when trimming (None keeps crops untrimmed)
+        measure_savings: also encode every crop as a default RGB PNG to report bytes saved
+        write_images, keep_image_bytes: write image files, keep them in results["questions"]
+        ollama_host, http_pool_size, connect_timeout: pooled keep-alive connection to Ollama
+        keep_alive: how long Ollama keeps the model resident; release_model() unloads it
+        """
         self.model_name = model_name
-        self.ollama_url = "http://localhost:11434/api/generate"
+        self.render_workers = render_workers
+        self.write_images = write_images
+        self.keep_image_bytes = keep_image_bytes
+        self.measure_savings = measure_savings
+        self.textpage_cache_size = textpage_cache_size
+        self.textpage_cache = OrderedDict()
+        self.ollama = get_client(ollama_host, http_pool_size, connect_timeout)
+        self.ollama_url = f"{self.ollama.host}/api/generate"
+        self.model_residency = ModelResidency([self.ollama], keep_alive)
         self.output_dir = output_dir
         self.deepseek_api_url = "https://api.deepseek.com/v1/chat/completions"  # Update with actual URL
         
         # Structural patterns for exam format
         self.question_delimiter_pattern = r'Question Number\s*:\s*(\d+)\s+Question Id\s*:\s*(\d+)'
         self.question_block_pattern = r'(Question Number\s*:.*?)(?=Question Number\s*:|$)'
+        self.question_start_pattern = re.compile(r'Question Number\s*:', re.IGNORECASE)
+        self.question_end_pattern = r'(Sub-Section Number|Section Id|Question Id|Question Numbers)\s*:'
+        # Where the question itself ends in a block; the answer key must not reach a solver
+        self.question_body_end_pattern = re.compile(
+            r'^\s*(?:Possible Answers|Sub-Section Number|Section Id|Question Id|Question Numbers)\s*:',
+            re.IGNORECASE | re.MULTILINE
+        )
+        
+        # Question text patterns in priority order, each capturing the question
+        # as q<i>; lazy spans are bounded so long blocks can't backtrack far, and
+        # a question line is only tried from its first letter
+        span = "{0,%d}?" % 1000
+        self.question_text_patterns = [
+            r'Question Label\s*:\s*[^\n]*\n\n(?P<q0>[^\n]+\?)',
+            r'Based on.' + span + r'answer.' + span + r'\n\n(?P<q1>[^\n]+\?)',
+            r'^[^A-Z\n]*(?P<q2>[A-Z][^\n]*\?)',
+            r'(?P<q3>What is.' + span + r'\?)',
+            r'(?P<q4>How (?:much|many).' + span + r'\?)',
+            r'(?P<q5>Which of.' + span + r'\?)',
+            r'(?P<q6>In how many.' + span + r'\?)',
+            r'(?P<q7>If .' + span + r'\?)',
+        ]
+        self.question_text_matcher = re.compile(
+            "|".join(f"(?P<p{i}>{pattern})" for i, pattern in enumerate(self.question_text_patterns)),
+            re.IGNORECASE | re.DOTALL | re.MULTILINE
+        )
+        
+        # Padding around layout-based question crops, and the vertical gap
+        # (in points) that separates a question from a following section title
+        self.crop_margin = 8
+        self.section_gap = 36
+        
+        # Figures smaller than this (in points) are icons such as option
+        # bullets, or rules and borders, not content a solver needs to see
+        self.min_image_figure_side = 16
+        self.min_drawing_figure_side = 2
+        
+        # Following pages searched for the rest of a question cut by a page break
+        self.max_continuation_pages = 2
+        
+        # AI question-text fallback: blocks per request, most concurrent requests
+        # (grown from one while the server keeps up)
+        self.ai_batch_size = 8
+        self.ai_workers = 4
+        self.ai_limiter = ConcurrencyLimiter(max_limit=self.ai_workers)
+        self.ai_batch_timeout = 120
+        
+        # Generation settings and prompts; all of them are part of AI cache keys
+        self.ollama_options = {"temperature": 0.1, "top_p": 0.9}
+        self.ai_question_prompt = """Extract the main question from this exam block.
+Return only the question text, nothing else.
+
+Block:
+{block}
+
+Question:"""
+        self.ai_batch_prompt = """Extract the main question from each of these exam blocks.
+Return a JSON object mapping each block number to its question text only,
+for example {{"1": "question text", "2": "question text"}}.
+
+{blocks}
+
+JSON:"""
+        
+        # Rendering settings; all of them are part of render cache keys
+        self.render_options = {
+            "zoom": 2.5,
+            "max_side": max_image_side,
+            "format": image_format,
+            "colorspace": image_colorspace,
+            "colors": image_colors,
+            "quality": image_quality,
+            "trim_margin": trim_margin
+        }
+        
+        # Archival renders stay full-color PNG
+        self.archive_dir = archive_dir
+        self.archive_options = {"zoom": archive_zoom, "max_side": None, "format": "png"}
+        
+        self.ai_cache = None
+        self.render_cache_dir = None
+        self.render_cache_size = render_cache_size
+        if cache_dir:
+            self.ai_cache = ResultCache(os.path.join(cache_dir, "ai_questions.sqlite"), ai_cache_size)
+            self.render_cache_dir = os.path.join(cache_dir, "renders")
         
-        # Ensure output directory exists
+        # Page index of question delimiters, rebuilt on every process_pdf run
+        self.question_index = {}
+        self.question_number_index = {}
+        self.page_delimiters = {}
+        self.page_figures = {}
+        
+        # Ensure output directories exist
         os.makedirs(self.output_dir, exist_ok=True)
+        if self.archive_dir:
+            os.makedirs(self.archive_dir, exist_ok=True)
     
     def check_ollama_status(self):
         """Check if Ollama is running and model is available"""
         try:
-            response = requests.get("http://localhost:11434/api/tags", timeout=5)
+            response = self.ollama.get("/api/tags", read_timeout=5)
             if response.status_code != 200:
                 return {"status": False, "message": "Ollama is not running"}
                 
@@ -46,24 +349,55 @@ class QuestionExtractor:
         except Exception as e:
             return {"status": False, "message": f"Connection error: {str(e)}"}
     
-    def query_ollama(self, prompt, timeout=30):
-        """Send query to Ollama"""
+    def query_ollama(self, prompt, timeout=30, json_format=False, options=None):
+        """Send query to Ollama, waiting up to timeout seconds for the reply"""
         payload = {
             "model": self.model_name,
             "prompt": prompt,
+            "keep_alive": self.model_residency.keep_alive,
             "stream": False,
-            "options": {"temperature": 0.1, "top_p": 0.9}
+            "options": {**self.ollama_options, **(options or {})}
         }
+        if json_format:
+            payload["format"] = "json"
         
         try:
-            response = requests.post(self.ollama_url, json=payload, timeout=timeout)
+            self.model_residency.ensure_loaded(self.model_name)
+            with self.ai_limiter.slot() as report_status:
+                response = self.ollama.post("/api/generate", payload, read_timeout=timeout)
+                report_status(response.status_code)
             if response.status_code == 200:
-                return json.loads(response.text)["response"]
+                reply = json.loads(response.text)
+                self.model_residency.record(self.model_name, reply)
+                return reply["response"]
         except Exception as e:
             print(f"Ollama query failed: {e}")
         
         return None
     
+    def release_model(self):
+        """Unload the AI fallback model from Ollama if it was loaded"""
+        if self.model_name in self.model_residency.loaded:
+            self.model_residency.release(self.model_name)
+    
+    def parse_question_block(self, block, block_index):
+        """Turn a raw question block into question data, or None without a delimiter"""
+        delimiter_match = re.search(self.question_delimiter_pattern, block, re.IGNORECASE)
+        
+        if not delimiter_match:
+            return None
+        
+        # Extract the actual question text; None leaves it for the batched AI fallback
+        question_text = self.match_question_text(block)
+        
+        return {
+            'question_number': int(delimiter_match.group(1)),
+            'question_id': delimiter_match.group(2),
+            'question_text': question_text,
+            'full_block': block,
+            'block_index': block_index
+        }
+    
     def extract_question_blocks(self, text):
         """Extract complete question blocks using structural delimiters"""
         question_blocks = re.findall(self.question_block_pattern, text, re.DOTALL | re.IGNORECASE)
@@ -71,117 +405,707 @@ class QuestionExtractor:
         extracted_questions = []
         
         for i, block in enumerate(question_blocks):
-            delimiter_match = re.search(self.question_delimiter_pattern, block, re.IGNORECASE)
-            
-            if delimiter_match:
-                question_number = delimiter_match.group(1)
-                question_id = delimiter_match.group(2)
-                
-                # Extract the actual question text
-                question_text = self.extract_question_text(block)
-                
-                extracted_questions.append({
-                    'question_number': int(question_number),
-                    'question_id': question_id,
-                    'question_text': question_text,
-                    'full_block': block,
-                    'block_index': i
-                })
+            question_data = self.parse_question_block(block, i)
+            if question_data:
+                extracted_questions.append(question_data)
+        
+        self.fill_question_text_with_ai(extracted_questions, [q['full_block'] for q in extracted_questions])
         
         return extracted_questions
     
+    def stream_question_blocks(self, doc):
+        """Yield raw question blocks page by page as soon as each one is closed
+        
+        Only the text since the last question delimiter is kept between pages,
+        so a block that runs over a page break is carried to the next page.
+        Question delimiters and content figures are indexed as their page is read.
+        """
+        pending = ""
+        
+        for page in doc:
+            pending += page.get_text(textpage=self.get_textpage(page)) + "\n"
+            self.index_page_questions(page)
+            self.index_page_figures(page)
+            
+            starts = [match.start() for match in self.question_start_pattern.finditer(pending)]
+            if not starts:
+                # Text before the first delimiter never belongs to a question;
+                # keep a short tail in case a delimiter is split by the page break
+                pending = pending[-64:]
+                continue
+            
+            # Every block followed by another delimiter is complete
+            for start, end in zip(starts, starts[1:]):
+                yield pending[start:end]
+            
+            pending = pending[starts[-1]:]
+        
+        # The last block runs to the end of the document
+        if self.question_start_pattern.match(pending):
+            yield pending[:-1] if pending.endswith("\n") else pending
+    
+    def iter_questions(self, doc):
+        """Yield question data for each block of an open document"""
+        for i, block in enumerate(self.stream_question_blocks(doc)):
+            question_data = self.parse_question_block(block, i)
+            if question_data:
+                yield question_data
+    
+    def match_question_text(self, block):
+        """Extract question text from block with one scan of all patterns, or None"""
+        # Every pattern ends in '?', so nothing after the last one can match
+        end = block.rfind('?')
+        if end < 0:
+            return None
+        
+        # Longest match of each pattern, keyed by pattern priority
+        longest = {}
+        for match in self.question_text_matcher.finditer(block, 0, end + 1):
+            priority = int(match.lastgroup[1:])
+            question = match.group(f"q{priority}")
+            if len(question) > len(longest.get(priority, "")):
+                longest[priority] = question
+        
+        for priority in sorted(longest):
+            question = longest[priority].strip()
+            if len(question) > 15 and '?' in question:
+                return question
+        
+        return None
+    
     def extract_question_text(self, block):
         """Extract question text from block using patterns + AI"""
         # Try pattern-based extraction first
-        patterns = [
-            r'Question Label\s*:\s*[^\n]*\n\n([^\n]+\?)',
-            r'Based on.*?answer.*?\n\n([^\n]+\?)',
-            r'([A-Z][^\n]*\?)',
-            r'What is.*?\?',
-            r'How (?:much|many).*?\?',
-            r'Which of.*?\?',
-            r'In how many.*?\?',
-            r'If .*?\?',
-        ]
-        
-        for pattern in patterns:
-            matches = re.findall(pattern, block, re.IGNORECASE | re.DOTALL)
-            if matches:
-                question = max(matches, key=len).strip()
-                if len(question) > 15 and '?' in question:
-                    return question
+        question = self.match_question_text(block)
+        if question:
+            return question
         
         # Fallback to AI extraction
         return self.extract_question_with_ai(block)
     
+    def question_body(self, block):
+        """Question text of a block as a solver should see it, without the answer key
+        
+        Drops the delimiter line and anything from the next section on, and
+        collapses the blank and whitespace-only lines of the text layer.
+        """
+        body = block.split("\n", 1)[1] if "\n" in block else ""
+        end_match = self.question_body_end_pattern.search(body)
+        if end_match:
+            body = body[:end_match.start()]
+        
+        lines = [line.replace("\xa0", " ").strip() for line in body.splitlines()]
+        return "\n".join(line for line in lines if line)
+    
     def extract_question_with_ai(self, block):
         """Use AI to extract question from complex blocks"""
-        prompt = f"""Extract the main question from this exam block.
-Return only the question text, nothing else.
-
-Block:
-{block[:1000]}
-
-Question:"""
+        question = self.get_cached_ai_question(block) or self.ask_ai_for_question(block)
+        if question:
+            return question
+        
+        return f"Question {block[:50]}..."  # Fallback
+    
+    def ask_ai_for_question(self, block):
+        """Query the AI for a single block's question, caching a usable reply"""
+        response = self.query_ollama(self.ai_question_prompt.format(block=block[:1000]))
+        question = self.clean_ai_question(response)
+        if question:
+            self.cache_ai_question(block, question)
+        
+        return question
+    
+    def ai_question_cache_key(self, block):
+        """Cache key covering everything that determines the AI's answer for a block"""
+        return ResultCache.make_key(
+            block[:1000], self.model_name, self.ai_question_prompt,
+            self.ai_batch_prompt, self.ollama_options
+        )
+    
+    def get_cached_ai_question(self, block):
+        """Get a previously extracted question for a block, or None"""
+        if not self.ai_cache:
+            return None
+        return self.ai_cache.get(self.ai_question_cache_key(block))
+    
+    def cache_ai_question(self, block, question):
+        """Remember an AI-extracted question for a block"""
+        if self.ai_cache:
+            self.ai_cache.put(self.ai_question_cache_key(block), question)
+    
+    def clean_ai_question(self, response):
+        """Strip an AI reply down to the question text, or None if unusable"""
+        if not isinstance(response, str):
+            return None
+        
+        question = response.strip()
+        question = re.sub(r'^(Question:|Answer:|The question is:?)', '', question, flags=re.IGNORECASE).strip()
+        
+        if len(question) > 10 and not question.lower().startswith('i cannot'):
+            return question
+        
+        return None
+    
+    def extract_question_batch_with_ai(self, blocks):
+        """Use AI to extract the questions of several blocks in a single request"""
+        # The caller already looked the blocks up in the AI cache
+        if len(blocks) == 1:
+            return [self.ask_ai_for_question(blocks[0]) or f"Question {blocks[0][:50]}..."]
+        
+        numbered_blocks = "\n\n".join(
+            f"Block {i}:\n{block[:1000]}" for i, block in enumerate(blocks, 1)
+        )
+        prompt = self.ai_batch_prompt.format(blocks=numbered_blocks)
         
-        response = self.query_ollama(prompt)
+        response = self.query_ollama(
+            prompt, timeout=self.ai_batch_timeout, json_format=True, options={"num_ctx": 8192}
+        )
+        
+        answers = {}
         if response:
-            question = response.strip()
-            question = re.sub(r'^(Question:|Answer:|The question is:?)', '', question, flags=re.IGNORECASE).strip()
+            try:
+                answers = json.loads(response)
+            except ValueError:
+                print("Ollama batch reply was not valid JSON")
+            if not isinstance(answers, dict):
+                answers = {}
+        
+        # Blocks the batch reply missed are retried on their own
+        questions = []
+        for i, block in enumerate(blocks, 1):
+            question = self.clean_ai_question(answers.get(str(i)))
+            if question:
+                self.cache_ai_question(block, question)
+            else:
+                question = self.ask_ai_for_question(block) or f"Question {block[:50]}..."
+            questions.append(question)
+        
+        return questions
+    
+    def fill_question_text_with_ai(self, questions, blocks):
+        """Fill in missing question text from blocks, batching AI requests concurrently"""
+        pending = []
+        for question, block in zip(questions, blocks):
+            if question['question_text'] is not None:
+                continue
             
-            if len(question) > 10 and not question.lower().startswith('i cannot'):
-                return question
+            # Cached answers skip the AI entirely
+            question['question_text'] = self.get_cached_ai_question(block)
+            if question['question_text'] is None:
+                pending.append((question, block))
         
-        return f"Question {block[:50]}..."  # Fallback
+        if not pending:
+            return
+        
+        batches = [
+            pending[i:i + self.ai_batch_size] for i in range(0, len(pending), self.ai_batch_size)
+        ]
+        
+        with ThreadPoolExecutor(max_workers=self.ai_workers) as pool:
+            replies = pool.map(
+                self.extract_question_batch_with_ai,
+                [[block for question, block in batch] for batch in batches]
+            )
+            for batch, batch_questions in zip(batches, replies):
+                for (question, block), question_text in zip(batch, batch_questions):
+                    question['question_text'] = question_text
+    
+    def get_page_cache(self, page):
+        """Get the cache entry for a page, extracting its text layer at most once"""
+        key = (id(page.parent), page.number)
+        cached = self.textpage_cache.get(key)
+        if cached:
+            self.textpage_cache.move_to_end(key)
+            return cached
+        
+        # Keep the page alongside its text layer, evicting least recently used
+        cached = {
+            'page': page,
+            'textpage': page.get_textpage(flags=fitz.TEXTFLAGS_TEXT)
+        }
+        self.textpage_cache[key] = cached
+        while len(self.textpage_cache) > self.textpage_cache_size:
+            self.textpage_cache.popitem(last=False)
+        
+        return cached
+    
+    def get_textpage(self, page):
+        """Get the page's cached text layer"""
+        return self.get_page_cache(page)['textpage']
+    
+    def get_page_layout(self, page):
+        """Get text line and figure rectangles of a page, computed once while cached"""
+        cached = self.get_page_cache(page)
+        if 'layout' in cached:
+            return cached['layout']
+        
+        page = cached['page']
+        lines = []
+        text_dict = page.get_text("dict", textpage=cached['textpage'])
+        for block in text_dict["blocks"]:
+            for line in block.get("lines", []):
+                text = "".join(span["text"] for span in line["spans"]).strip()
+                if text:
+                    lines.append((fitz.Rect(line["bbox"]), text))
+        
+        # Raster images and vector drawings (tables, charts) belong to questions too
+        figures = self.get_page_figures(page)['figures']
+        
+        cached['layout'] = {'lines': lines, 'figures': figures}
+        return cached['layout']
+    
+    def get_page_figures(self, page):
+        """Get image and drawing rectangles of a page, computed once while cached
+        
+        'figures' has all of them, which bound layout crops; 'content' keeps
+        images bigger than icons and visible drawings thicker than a rule.
+        """
+        cached = self.get_page_cache(page)
+        if 'figures' in cached:
+            return cached['figures']
+        
+        page = cached['page']
+        figures = []
+        content = []
+        
+        # Image placements, including inline images that get_images() doesn't list
+        for image in page.get_image_info():
+            rect = fitz.Rect(image["bbox"])
+            figures.append(rect)
+            if min(rect.width, rect.height) >= self.min_image_figure_side:
+                content.append(rect)
+        
+        # White-filled cell borders are invisible and thin rules only frame text
+        for drawing in page.get_drawings():
+            rect = fitz.Rect(drawing["rect"])
+            figures.append(rect)
+            if (min(rect.width, rect.height) >= self.min_drawing_figure_side
+                    and (has_ink(drawing.get("fill")) or has_ink(drawing.get("color")))):
+                content.append(rect)
+        
+        cached['figures'] = {'figures': figures, 'content': content}
+        return cached['figures']
+    
+    def index_page_figures(self, page):
+        """Record the content figure rectangles of a page"""
+        self.page_figures[page.number] = self.get_page_figures(page)['content']
+    
+    def index_page_questions(self, page):
+        """Record number, id, page and bbox of every question delimiter on a page"""
+        words = page.get_text("words", textpage=self.get_textpage(page))
+        
+        # Join words with single spaces, remembering where each word starts
+        offsets = []
+        position = 0
+        for word in words:
+            offsets.append(position)
+            position += len(word[4]) + 1
+        page_words = " ".join(word[4] for word in words)
+        
+        for match in re.finditer(self.question_delimiter_pattern, page_words, re.IGNORECASE):
+            # Words covering "Question Number : N" give the delimiter bbox
+            bbox = fitz.Rect()
+            for offset, word in zip(offsets, words):
+                if offset >= match.end(1):
+                    break
+                if offset + len(word[4]) > match.start():
+                    bbox |= fitz.Rect(word[:4])
+            
+            entry = {
+                'question_number': int(match.group(1)),
+                'question_id': match.group(2),
+                'page': page.number,
+                'bbox': bbox
+            }
+            self.question_index.setdefault(entry['question_id'], entry)
+            self.question_number_index.setdefault(entry['question_number'], entry)
+            self.page_delimiters.setdefault(page.number, []).append(bbox)
+    
+    def lookup_question(self, question_number, question_id):
+        """Get the index entry for a question, preferring its unique id"""
+        entry = self.question_index.get(str(question_id))
+        if entry is None:
+            entry = self.question_number_index.get(int(question_number))
+        return entry
     
     def find_question_on_page(self, page, question_number, question_id):
         """Find question location on page"""
+        entry = self.lookup_question(question_number, question_id)
+        if entry:
+            return entry['bbox'] if entry['page'] == page.number else None
+        
+        # Not indexed: search the page's cached text layer
         search_strategies = [
             f"Question Number : {question_number}",
             f"Question Id : {question_id}",
         ]
         
+        cached = self.get_page_cache(page)
         for strategy in search_strategies:
-            instances = page.search_for(strategy)
+            instances = cached['page'].search_for(strategy, textpage=cached['textpage'])
             if instances:
                 return instances[0]
         
         return None
     
+    def get_layout_region(self, page, top, bottom, headers_from):
+        """Tight bbox of the lines and figures between top and bottom of a page
+        
+        Returns (clip or None, ends_at_section); a section header found below
+        headers_from cuts the region short.
+        """
+        layout = self.get_page_layout(page)
+        
+        ends_at_section = False
+        for rect, text in layout['lines']:
+            if headers_from <= rect.y0 < bottom and re.match(self.question_end_pattern, text, re.IGNORECASE):
+                bottom = rect.y0
+                ends_at_section = True
+        
+        rects = [rect for rect, text in layout['lines']] + layout['figures']
+        rects = sorted(
+            (rect for rect in rects if top <= (rect.y0 + rect.y1) / 2 < bottom),
+            key=lambda rect: rect.y0
+        )
+        
+        if ends_at_section:
+            # A section title sits above its header, set apart by a wide gap
+            content_bottom = None
+            for i, rect in enumerate(rects):
+                if content_bottom is not None and rect.y0 - content_bottom > self.section_gap:
+                    rects = rects[:i]
+                    break
+                content_bottom = rect.y1 if content_bottom is None else max(content_bottom, rect.y1)
+        
+        clip_rect = fitz.Rect()
+        for rect in rects:
+            clip_rect |= rect
+        
+        if clip_rect.is_empty:
+            return None, ends_at_section
+        
+        # Padding must not reach past top or bottom into the neighbouring lines
+        margin = self.crop_margin
+        clip_rect = fitz.Rect(
+            clip_rect.x0 - margin, max(clip_rect.y0 - margin, min(top, clip_rect.y0)),
+            clip_rect.x1 + margin, min(clip_rect.y1 + margin, max(bottom, clip_rect.y1))
+        )
+        return clip_rect & page.rect, ends_at_section
+    
+    def get_layout_clip(self, page, question_bbox, next_question_bbox):
+        """Tight bbox of the text lines and figures belonging to a question, or None"""
+        # The question runs from its delimiter to the next delimiter or section header
+        bottom = next_question_bbox.y0 if next_question_bbox else page.rect.y1
+        clip_rect, ends_at_section = self.get_layout_region(
+            page, question_bbox.y0, bottom, question_bbox.y1
+        )
+        return clip_rect
+    
+    def question_continues(self, page, question_bbox, next_question_bbox):
+        """Whether a question runs past the bottom of its page"""
+        if not question_bbox or next_question_bbox:
+            return False
+        
+        clip_rect, ends_at_section = self.get_layout_region(
+            page, question_bbox.y0, page.rect.y1, question_bbox.y1
+        )
+        return not ends_at_section
+    
+    def get_continuation_segments(self, doc, page_num):
+        """(page, clip) regions continuing a question onto the following pages"""
+        segments = []
+        
+        last_page = min(len(doc), page_num + 1 + self.max_continuation_pages)
+        for next_page_num in range(page_num + 1, last_page):
+            page = doc[next_page_num]
+            
+            # The continuation stops at the page's first question delimiter
+            delimiters = self.page_delimiters.get(next_page_num, [])
+            bottom = min((bbox.y0 for bbox in delimiters), default=page.rect.y1)
+            
+            clip_rect, ends_at_section = self.get_layout_region(
+                page, page.rect.y0, bottom, page.rect.y0
+            )
+            if clip_rect:
+                segments.append((page, clip_rect))
+            
+            if delimiters or ends_at_section:
+                break
+        
+        return segments
+    
+    def question_has_figure(self, segments):
+        """Whether any (page, clip) region of a question overlaps a content figure"""
+        for page, clip_rect in segments:
+            figures = self.page_figures.get(page.number)
+            if figures is None:
+                figures = self.get_page_figures(page)['content']
+            if any(clip_rect.intersects(figure) for figure in figures):
+                return True
+        return False
+    
+    def get_question_clip(self, page, question_bbox, next_question_bbox):
+        """Work out the page region to render for a question"""
+        page_rect = page.rect
+        
+        if not question_bbox:
+            # Full page fallback
+            return fitz.Rect(0, 0, page_rect.width, page_rect.height)
+        
+        # Crop to the question's own text and figures where the page has a layout
+        clip_rect = self.get_layout_clip(page, question_bbox, next_question_bbox)
+        if clip_rect:
+            return clip_rect
+        
+        # Smart cropping
+        x0 = 0
+        y0 = max(0, question_bbox.y0 - 20)
+        x1 = page_rect.width
+        
+        if next_question_bbox:
+            y1 = max(question_bbox.y1 + 50, next_question_bbox.y0 - 15)
+        else:
+            y1 = min(page_rect.height, question_bbox.y1 + 300)
+        
+        return fitz.Rect(x0, y0, x1, y1)
+    
     def extract_question_image(self, page, question_bbox, next_question_bbox, output_path):
         """Extract high-quality question image"""
         try:
-            page_rect = page.rect
+            clip_rect = self.get_question_clip(page, question_bbox, next_question_bbox)
+        except Exception as e:
+            print(f"Image extraction failed: {e}")
+            return False
+        
+        return render_clip(page, clip_rect, output_path, self.render_options) is not None
+    
+    def render_jobs_in_parallel(self, pdf_path, render_jobs, render_options):
+        """Render jobs across worker processes, yielding results in job order"""
+        # Contiguous shards keep each worker on neighbouring pages
+        shard_size = max(1, -(-len(render_jobs) // (self.render_workers * 4)))
+        shards = [render_jobs[i:i + shard_size] for i in range(0, len(render_jobs), shard_size)]
+        
+        with ProcessPoolExecutor(max_workers=self.render_workers,
+                                 initializer=open_worker_document,
+                                 initargs=(pdf_path, render_options)) as pool:
+            for shard_results in pool.map(render_job_shard, shards):
+                yield from shard_results
+    
+    def run_render_jobs(self, doc, pdf_path, render_jobs, render_options):
+        """Render jobs in the pool or in-process, yielding results in job order"""
+        if self.render_workers > 1 and len(render_jobs) > 1:
+            yield from self.render_jobs_in_parallel(pdf_path, render_jobs, render_options)
+        else:
+            for job in render_jobs:
+                yield run_render_job(doc, job, render_options)
+    
+    def extract_question(self, doc, question_data, next_data):
+        """Locate a question in the document and work out the regions to render"""
+        # Find page containing this question
+        entry = self.lookup_question(
+            question_data['question_number'],
+            question_data['question_id']
+        )
+        
+        if not entry:
+            return None
+        
+        question_page_num = entry['page']
+        question_page = doc[question_page_num]
+        
+        # Get question and next question locations
+        question_bbox = self.find_question_on_page(
+            question_page, 
+            question_data['question_number'], 
+            question_data['question_id']
+        )
+        
+        next_question_bbox = None
+        if next_data:
+            # Try to find next question on same page
+            next_question_bbox = self.find_question_on_page(
+                question_page,
+                next_data['question_number'],
+                next_data['question_id']
+            )
+        
+        # Crop regions, stitching in the continuation of a question split by a page break
+        try:
+            clip_rect = self.get_question_clip(question_page, question_bbox, next_question_bbox)
+            segments = [(question_page, clip_rect)]
             
-            if not question_bbox:
-                # Full page fallback
-                clip_rect = fitz.Rect(0, 0, page_rect.width, page_rect.height)
-            else:
-                # Smart cropping
-                x0 = 0
-                y0 = max(0, question_bbox.y0 - 20)
-                x1 = page_rect.width
-                
-                if next_question_bbox:
-                    y1 = max(question_bbox.y1 + 50, next_question_bbox.y0 - 15)
-                else:
-                    y1 = min(page_rect.height, question_bbox.y1 + 300)
-                
-                clip_rect = fitz.Rect(x0, y0, x1, y1)
+            if self.question_continues(question_page, question_bbox, next_question_bbox):
+                segments += self.get_continuation_segments(doc, question_page_num)
+        except Exception as e:
+            print(f"Image extraction failed: {e}")
+            return None
+        
+        return {
+            'question_number': question_data['question_number'],
+            'question_id': question_data['question_id'],
+            'page': question_page_num + 1,
+            'question_text': question_data['question_text'],
+            'question_body': self.question_body(question_data['full_block']),
+            'has_figure': self.question_has_figure(segments),
+            'segments': [(page.number, tuple(clip_rect)) for page, clip_rect in segments]
+        }
+    
+    def name_question(self, question):
+        """Set the image filename and path of a located question"""
+        safe_text = re.sub(r'[^\w\s-]', '', question['question_text'][:40])
+        safe_text = re.sub(r'[-\s]+', '_', safe_text).strip('_')
+        
+        name = f"Q{question['question_number']:03d}_P{question['page']}_{safe_text}"
+        extension = IMAGE_EXTENSIONS[self.render_options['format']]
+        
+        question['filename'] = f"{name}.{extension}"
+        question['file_path'] = os.path.join(self.output_dir, question['filename'])
+        if self.archive_dir:
+            question['archive_path'] = os.path.join(self.archive_dir, f"{name}.png")
+    
+    def render_cache_path(self, pdf_hash, segments, render_options):
+        """Render cache file for a set of regions of a given PDF"""
+        key = ResultCache.make_key(pdf_hash, segments, render_options)
+        return os.path.join(self.render_cache_dir, f"{key}.{IMAGE_EXTENSIONS[render_options['format']]}")
+    
+    def prune_render_cache(self):
+        """Delete least recently used renders until the render cache fits in render_cache_size"""
+        entries = {}
+        for name in os.listdir(self.render_cache_dir):
+            path = os.path.join(self.render_cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            # An image and its .json info are one entry, last used when the image was
+            image_path = path[:-len(".json")] if name.endswith(".json") else path
+            entry = entries.setdefault(image_path, {"size": 0, "last_used": 0.0, "paths": []})
+            entry["size"] += stat.st_size
+            entry["paths"].append(path)
+            if path == image_path:
+                entry["last_used"] = stat.st_mtime
+        
+        total = sum(entry["size"] for entry in entries.values())
+        for entry in sorted(entries.values(), key=lambda entry: entry["last_used"]):
+            if total <= self.render_cache_size:
+                break
+            for path in entry["paths"]:
+                try:
+                    # Linked output images keep their own link
+                    os.unlink(path)
+                except OSError as e:
+                    print(f"Render cache prune failed: {e}")
+            total -= entry["size"]
+    
+    def read_render_info(self, cache_path):
+        """Image info stored next to a cached render, or measured from the file without it"""
+        try:
+            with open(f"{cache_path}.json", encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            with Image.open(cache_path) as image:
+                image_bytes = os.path.getsize(cache_path)
+                return {"width": image.width, "height": image.height, "bytes": image_bytes}
+    
+    def render_questions(self, doc, pdf_path, questions, render_options, path_key='file_path',
+                         write_files=True, keep_bytes=False, info_key='image_info', measure_png=False):
+        """Render located questions to the image files named by question[path_key]
+        
+        Images already in the render cache are linked into place instead of
+        rendered. Without write_files nothing is written to question[path_key],
+        which is set to None; keep_bytes attaches the encoded image to each
+        question as 'image_bytes'. Each question's image info from
+        render_segments goes in question[info_key], with png_bytes when
+        measure_png is set. Returns the questions that succeeded and the cache
+        hit count.
+        """
+        cache_paths = [None] * len(questions)
+        if self.render_cache_dir:
+            os.makedirs(self.render_cache_dir, exist_ok=True)
+            pdf_hash = hash_file(pdf_path)
+            cache_paths = [
+                self.render_cache_path(pdf_hash, question['segments'], render_options)
+                for question in questions
+            ]
+        
+        rendered = [False] * len(questions)
+        render_jobs = []
+        job_indices = []
+        cache_hits = 0
+        
+        for i, (question, cache_path) in enumerate(zip(questions, cache_paths)):
+            output_path = question[path_key] if write_files else None
             
-            # High-quality rendering
-            mat = fitz.Matrix(2.5, 2.5)
-            pix = page.get_pixmap(matrix=mat, clip=clip_rect)
+            cached_info = None
+            if cache_path and os.path.exists(cache_path):
+                try:
+                    cached_info = self.read_render_info(cache_path)
+                except OSError as e:
+                    print(f"Render cache read failed: {e}")
             
-            # Save image
-            pix.save(output_path)
-            pix = None
+            # Renders cached without their default PNG size are redone when it's wanted
+            if cached_info and (not measure_png or "png_bytes" in cached_info):
+                try:
+                    if output_path:
+                        link_file(cache_path, output_path)
+                    if keep_bytes:
+                        with open(cache_path, 'rb') as f:
+                            question['image_bytes'] = f.read()
+                    question[info_key] = cached_info
+                    os.utime(cache_path)  # Last used, for pruning
+                    rendered[i] = True
+                    cache_hits += 1
+                    continue
+                except OSError as e:
+                    print(f"Render cache read failed: {e}")
             
-            return True
+            # Never write through an old hard link into the cache
+            if output_path and os.path.exists(output_path):
+                os.unlink(output_path)
             
-        except Exception as e:
-            print(f"Image extraction failed: {e}")
-            return False
+            # Bytes come back when kept, or when only they can fill the cache
+            return_bytes = keep_bytes or (cache_path is not None and not output_path)
+            render_jobs.append((question['segments'], output_path, return_bytes, measure_png))
+            job_indices.append(i)
+        
+        job_results = self.run_render_jobs(doc, pdf_path, render_jobs, render_options)
+        for i, job, (result, image_info) in zip(job_indices, render_jobs, job_results):
+            output_path = job[1]
+            rendered[i] = bool(result)
+            if not result:
+                continue
+            
+            questions[i][info_key] = image_info
+            if keep_bytes:
+                questions[i]['image_bytes'] = result
+            
+            if cache_paths[i]:
+                try:
+                    if output_path:
+                        link_file(output_path, cache_paths[i])
+                    else:
+                        with open(cache_paths[i], 'wb') as f:
+                            f.write(result)
+                    with open(f"{cache_paths[i]}.json", 'w', encoding='utf-8') as f:
+                        json.dump(image_info, f)
+                except OSError as e:
+                    print(f"Render cache write failed: {e}")
+        
+        if self.render_cache_dir:
+            self.prune_render_cache()
+        
+        if not write_files:
+            for question in questions:
+                question[path_key] = None
+        
+        return [question for question, success in zip(questions, rendered) if success], cache_hits
+    
+    def measure_images(self, questions):
+        """Total size of question images, and as default RGB PNGs (None unless every one was measured)"""
+        image_infos = [question['image_info'] for question in questions if question.get('image_info')]
+        image_bytes = sum(info["bytes"] for info in image_infos)
+        if not all("png_bytes" in info for info in image_infos):
+            return image_bytes, None
+        return image_bytes, sum(info["png_bytes"] for info in image_infos)
     
     def process_pdf(self, pdf_path):
         """Main processing function"""
@@ -191,8 +1115,22 @@ Question:"""
             "questions_found": 0,
             "questions_extracted": 0,
             "output_files": [],
+            "questions": [],
             "report_path": "",
-            "viewer_path": ""
+            "viewer_path": "",
+            "ai_cache_hits": 0,
+            "ai_cache_misses": 0,
+            "ai_cache_hit_rate": 0.0,
+            "ai_concurrency_limit": 0,
+            "ai_latency_p50": None,
+            "ai_latency_p95": None,
+            "ai_load_seconds": 0.0,
+            "ai_inference_seconds": 0.0,
+            "render_cache_hits": 0,
+            "archive_files": [],
+            "image_bytes": 0,
+            "image_bytes_png": None,
+            "image_bytes_saved": None
         }
         
         # Check Ollama
@@ -208,81 +1146,88 @@ Question:"""
             results["message"] = f"Cannot open PDF: {e}"
             return results
         
-        # Extract full document text
-        full_text = ""
-        for page in doc:
-            full_text += page.get_text() + "\n"
-        
-        # Extract question blocks
-        question_blocks = self.extract_question_blocks(full_text)
-        results["questions_found"] = len(question_blocks)
+        # Stream question blocks page by page, indexing delimiters as we go
+        self.question_index = {}
+        self.question_number_index = {}
+        self.page_delimiters = {}
+        self.page_figures = {}
+        self.textpage_cache.clear()
+        questions = self.iter_questions(doc)
+        question_data = next(questions, None)
         
-        if not question_blocks:
+        if not question_data:
             results["message"] = "No questions found using structural pattern"
+            self.textpage_cache.clear()
             doc.close()
             return results
         
-        # Process each question
+        # Locate each question once the following block has been read
         extracted_questions = []
+        ai_blocks = []
         
-        for i, question_data in enumerate(question_blocks):
-            # Find page containing this question
-            question_page = None
-            question_page_num = None
-            
-            for page_num in range(len(doc)):
-                page = doc[page_num]
-                search_text = f"Question Number : {question_data['question_number']}"
-                if page.search_for(search_text):
-                    question_page = page
-                    question_page_num = page_num
-                    break
-            
-            if not question_page:
-                continue
+        while question_data:
+            next_data = next(questions, None)
+            results["questions_found"] += 1
             
-            # Get question and next question locations
-            question_bbox = self.find_question_on_page(
-                question_page, 
-                question_data['question_number'], 
-                question_data['question_id']
-            )
-            
-            next_question_bbox = None
-            if i + 1 < len(question_blocks):
-                next_data = question_blocks[i + 1]
-                # Try to find next question on same page
-                next_question_bbox = self.find_question_on_page(
-                    question_page,
-                    next_data['question_number'],
-                    next_data['question_id']
+            question = self.extract_question(doc, question_data, next_data)
+            if question:
+                extracted_questions.append(question)
+                
+                # Only blocks the patterns couldn't handle are kept for the AI
+                ai_blocks.append(
+                    question_data['full_block'][:1000] if question['question_text'] is None else None
                 )
             
-            # Create filename
-            safe_text = re.sub(r'[^\w\s-]', '', question_data['question_text'][:40])
-            safe_text = re.sub(r'[-\s]+', '_', safe_text).strip('_')
-            
-            img_filename = f"Q{question_data['question_number']:03d}_P{question_page_num + 1}_{safe_text}.png"
-            img_path = os.path.join(self.output_dir, img_filename)
-            
-            # Extract image
-            success = self.extract_question_image(
-                question_page, question_bbox, next_question_bbox, img_path
+            question_data = next_data
+        
+        # Batched AI fallback for question text, then name and render images
+        cache_before = self.ai_cache.stats() if self.ai_cache else None
+        self.fill_question_text_with_ai(extracted_questions, ai_blocks)
+        
+        if self.ai_cache:
+            cache_after = self.ai_cache.stats()
+            results["ai_cache_hits"] = cache_after["hits"] - cache_before["hits"]
+            results["ai_cache_misses"] = cache_after["misses"] - cache_before["misses"]
+            lookups = results["ai_cache_hits"] + results["ai_cache_misses"]
+            if lookups:
+                results["ai_cache_hit_rate"] = results["ai_cache_hits"] / lookups
+        
+        ai_limits = self.ai_limiter.stats()
+        results["ai_concurrency_limit"] = ai_limits["limit"]
+        results["ai_latency_p50"] = ai_limits["latency_p50"]
+        results["ai_latency_p95"] = ai_limits["latency_p95"]
+        ai_timings = self.model_residency.stats()
+        results["ai_load_seconds"] = ai_timings["load_seconds"]
+        results["ai_inference_seconds"] = ai_timings["inference_seconds"]
+        for question in extracted_questions:
+            self.name_question(question)
+        
+        extracted_questions, results["render_cache_hits"] = self.render_questions(
+            doc, pdf_path, extracted_questions, self.render_options,
+            write_files=self.write_images, keep_bytes=self.keep_image_bytes,
+            measure_png=self.measure_savings
+        )
+        
+        # Separate high-DPI copies for archiving, independent of the model's pixel budget
+        if self.archive_dir:
+            archived, archive_cache_hits = self.render_questions(
+                doc, pdf_path, extracted_questions, self.archive_options, 'archive_path',
+                info_key='archive_info'
             )
-            
-            if success:
-                extracted_questions.append({
-                    'question_number': question_data['question_number'],
-                    'question_id': question_data['question_id'],
-                    'page': question_page_num + 1,
-                    'question_text': question_data['question_text'],
-                    'filename': img_filename,
-                    'file_path': img_path
-                })
-                results["output_files"].append(img_path)
+            results["render_cache_hits"] += archive_cache_hits
+            results["archive_files"] = [question['archive_path'] for question in archived]
         
+        self.textpage_cache.clear()
         doc.close()
         
+        results["output_files"] = [
+            question['file_path'] for question in extracted_questions if question['file_path']
+        ]
+        results["questions"] = extracted_questions
+        results["image_bytes"], results["image_bytes_png"] = self.measure_images(extracted_questions)
+        if results["image_bytes_png"] is not None:
+            results["image_bytes_saved"] = results["image_bytes_png"] - results["image_bytes"]
+        
         results["questions_extracted"] = len(extracted_questions)
         
         # Generate reports
@@ -340,12 +1285,21 @@ h1 { color: #333; }
 """)
             
             for q in questions:
+                # Images that were only kept in memory are embedded; unwritten ones are left out
+                image_src = None
+                if q.get('file_path'):
+                    image_src = q['filename']
+                elif q.get('image_bytes'):
+                    image_data = base64.b64encode(q['image_bytes']).decode('ascii')
+                    image_src = f"data:image/{self.render_options['format']};base64,{image_data}"
+                image_tag = f'<img src="{image_src}" alt="Question {q["question_number"]}">' if image_src else ""
+                
                 f.write(f"""
 <div class="question">
 <h3>Question #{q['question_number']:03d} - Page {q['page']}</h3>
 <p><strong>ID:</strong> {q['question_id']}</p>
 <p><strong>Question:</strong> {q['question_text']}</p>
-<img src="{q['filename']}" alt="Question {q['question_number']}">
+{image_tag}
 </div>
 """)
             
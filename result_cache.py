@@ -0,0 +1,96 @@
+"""
+Persistent Result Cache
+Content-addressed SQLite store with size-bounded LRU eviction
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """SHA-256 of a file's contents, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class ResultCache:
+    def __init__(self, path, max_bytes=64 * 1024 * 1024):
+        """Open (or create) the cache database at path, holding at most max_bytes of values"""
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS entries "
+            "(key TEXT PRIMARY KEY, value BLOB, size INTEGER, last_used REAL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+        self.db.commit()
+    
+    @staticmethod
+    def make_key(*parts):
+        """Hash everything that determines a result into a cache key"""
+        encoded = json.dumps(parts, sort_keys=True, default=str).encode('utf-8')
+        return hashlib.sha256(encoded).hexdigest()
+    
+    def get(self, key):
+        """Get a cached value, or None on a miss"""
+        with self.lock:
+            row = self.db.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            
+            self.hits += 1
+            self.db.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.db.commit()
+            return row[0]
+    
+    def put(self, key, value):
+        """Store a str or bytes value, evicting least recently used entries past max_bytes"""
+        size = len(value.encode('utf-8')) if isinstance(value, str) else len(value)
+        
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, value, size, time.time())
+            )
+            self.evict()
+            self.db.commit()
+    
+    def evict(self):
+        """Drop least recently used entries until the cache fits in max_bytes"""
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        
+        expired = []
+        for key, size in self.db.execute("SELECT key, size FROM entries ORDER BY last_used"):
+            if total <= self.max_bytes:
+                break
+            expired.append((key,))
+            total -= size
+        
+        self.db.executemany("DELETE FROM entries WHERE key = ?", expired)
+    
+    def stats(self):
+        """Hit and miss counts since the cache was opened"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+    
+    def close(self):
+        """Close the database connection"""
+        with self.lock:
+            self.db.close()